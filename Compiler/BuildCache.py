@@ -0,0 +1,189 @@
+import os, os.path, glob, hashlib, json
+import Compiler.ClassIndex as classindex
+
+# Incremental build support. A compiled Xxx.vm depends on the source of
+# Xxx.jack, on the compiler itself and on the interfaces (subroutine kinds
+# and arguments, field count) of the classes Xxx uses. The output is stored
+# under a hash of the first two, together with the interfaces of the used
+# classes it was compiled against, and restored instead of compiling the
+# file again as long as none of those interfaces changed. Entries a build
+# of the whole directory didn't use are deleted when it ends.
+
+CACHE_DIR_NAME = ".jackcache"
+VM_SUFFIX = ".vm"
+INFO_SUFFIX = ".json"
+
+_fingerprint = None
+
+
+def compiler_fingerprint():
+    """
+    hash of the compiler's own source files, so a changed compiler never
+    reuses output of an older one
+    :return: hex digest
+    """
+    global _fingerprint
+    if _fingerprint is None:
+        digest = hashlib.sha1()
+        compiler_dir = os.path.dirname(os.path.abspath(__file__))
+        for module in sorted(glob.glob(os.path.join(compiler_dir, "*.py"))):
+            digest.update(os.path.basename(module).encode())
+            with open(module, 'rb') as module_file:
+                digest.update(module_file.read())
+        _fingerprint = digest.hexdigest()
+    return _fingerprint
+
+
+def interface_hash(interface):
+    """
+    :param interface: a class interface, see ClassIndex.get_interface
+    :return: hex digest of it
+    """
+    return hashlib.sha1(repr(interface).encode()).hexdigest()
+
+
+class BuildCache(object):
+    """
+    Content addressed store of compiled .vm files, kept in a directory next
+    to the sources
+    """
+    def __init__(self, directory):
+        """
+        :param directory: where the cached outputs are kept, created on the
+        first store
+        """
+        self.directory = directory
+
+    def key(self, source, options=""):
+        """
+        :param source: bytes of the .jack file
+        :param options: anything else that changes the output
+        :return: cache key of the compiled output
+        """
+        digest = hashlib.sha1(compiler_fingerprint().encode())
+        digest.update(options.encode())
+        digest.update(b"\0")
+        digest.update(source)
+        return digest.hexdigest()
+
+    def path(self, key):
+        """
+        :param key:
+        :return: file holding the output cached under key
+        """
+        return os.path.join(self.directory, key + VM_SUFFIX)
+
+    def info_path(self, key):
+        """
+        :param key:
+        :return: file describing the class cached under key
+        """
+        return os.path.join(self.directory, key + INFO_SUFFIX)
+
+    def load_index(self):
+        """
+        :return: the ClassIndex saved by the last build
+        """
+        return classindex.ClassIndex.load(
+            os.path.join(self.directory, classindex.INDEX_FILE_NAME))
+
+    def save_index(self, index):
+        """
+        saves the ClassIndex of this build, the signature of every class
+        keeps the cache key of its source
+        :param index:
+        :return:
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        index.save(os.path.join(self.directory, classindex.INDEX_FILE_NAME))
+
+    def lookup(self, key):
+        """
+        :param key:
+        :return: the class info stored with the output (see store), None on
+        a cache miss
+        """
+        try:
+            with open(self.info_path(key), 'r') as info_file:
+                return json.load(info_file)
+        except (OSError, ValueError):
+            return None
+
+    def restore(self, key, output_file_name):
+        """
+        writes the output cached under key to output_file_name. an output
+        file that is already up to date is left untouched.
+        :param key:
+        :param output_file_name:
+        :return: True if the output was restored, False on a cache miss
+        """
+        try:
+            with open(self.path(key), 'rb') as cached_file:
+                output = cached_file.read()
+        except OSError:
+            return False
+
+        try:
+            with open(output_file_name, 'rb') as output_file:
+                if output_file.read() == output:
+                    return True
+        except OSError:
+            pass
+
+        with open(output_file_name, 'wb') as output_file:
+            output_file.write(output)
+        return True
+
+    def store(self, key, output_file_name, info):
+        """
+        saves a freshly compiled output under key
+        :param key:
+        :param output_file_name:
+        :param info: dict with the class name and the interface hash of
+        every class it depends on, as compiled against
+        :return:
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        with open(output_file_name, 'rb') as output_file:
+            output = output_file.read()
+        self.write(self.path(key), output)
+        # the info goes last, a key without info is a miss
+        self.write(self.info_path(key), json.dumps(info, sort_keys=True).encode())
+
+    def prune(self, keys):
+        """
+        deletes the outputs cached under any other key, so the cache only
+        holds what the last build used instead of every version of every
+        file ever compiled
+        :param keys: cache keys of the files of this build
+        :return:
+        """
+        keys = set(keys)
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            key, suffix = os.path.splitext(name)
+            if suffix in (VM_SUFFIX, INFO_SUFFIX) and key not in keys and \
+                    name != classindex.INDEX_FILE_NAME:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    # already gone, removed by a build running alongside
+                    pass
+
+    def write(self, path, data):
+        """
+        writes a cache file aside and renames it into place, so parallel
+        builds never see half a file
+        :param path:
+        :param data: bytes
+        :return:
+        """
+        temp_name = path + "." + str(os.getpid())
+        with open(temp_name, 'wb') as cache_file:
+            cache_file.write(data)
+        os.replace(temp_name, path)
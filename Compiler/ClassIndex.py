@@ -0,0 +1,324 @@
+import os, os.path, json
+import Compiler.JackGrammar as grammar
+import Compiler.JackTokenizer as tokenizer
+
+# The signatures of all classes of a program: field and static counts and
+# the kind, return type and number of arguments of every subroutine.
+# Signatures are read by skimming: only the class header, the classVarDecs
+# and the subroutine declarations are looked at, subroutine bodies are
+# skipped by matching braces. skim() works on the raw source, skim_tokens()
+# on a file the compiler already tokenized.
+#
+# A signature is a dict, so it can be saved as json and sent to worker
+# processes as is:
+# {"class": name, "fields": n, "statics": n,
+#  "subroutines": {name: [kind, return type, number of arguments, getter]}}
+# methods count the object as an argument, like the VM function does.
+# getter is True for a method or function whose body is only
+# "return x;", x a variable, a constant or this: calling it has no effect.
+
+S_KIND = 0
+S_TYPE = 1
+S_ARGS = 2
+S_GETTER = 3
+
+INDEX_FILE_NAME = "index.json"
+
+# token types a getter may return, a string constant builds a new String on
+# every call
+GETTER_KINDS = (grammar.IDENTIFIER, grammar.INT_CONST, grammar.KEYWORD)
+
+
+def skim(source):
+    """
+    reads the signature of the class in source. only the declarations are
+    tokenized, bodies are jumped over to their closing brace.
+    :param source: open file, bytes or memoryview
+    :return: signature dict
+    """
+    code = tokenizer.read_source(source)
+    try:
+        return skim_code(code)
+    finally:
+        tokenizer.release_source(code)
+
+
+def skim_code(code):
+    """
+    reads the signature of the class in code, see skim
+    :param code: bytes-like source
+    :return: signature dict
+    """
+    value, position = next_token(code, 0)
+    if value != grammar.K_CLASS:
+        raise ValueError("No class found in the file")
+    class_name, position = next_token(code, position)
+    value, position = next_token(code, position)
+    if value != "{":
+        raise ValueError("No symbol { found")
+    signature = {"class": class_name, "fields": 0, "statics": 0,
+                 "subroutines": {}}
+
+    while True:
+        keyword, position = next_token(code, position)
+        if keyword == grammar.K_STATIC or keyword == grammar.K_FIELD:
+            # static|field type name (, name)* ;
+            names = 1
+            value, position = next_token(code, position)
+            while value != ";":
+                if value == ",":
+                    names += 1
+                value, position = next_token(code, position)
+            signature["statics" if keyword == grammar.K_STATIC
+                      else "fields"] += names
+
+        elif keyword in (grammar.K_CONSTRUCTOR, grammar.K_FUNCTION,
+                         grammar.K_METHOD):
+            # kind type name ( parameters ) { body }
+            return_type, position = next_token(code, position)
+            name, position = next_token(code, position)
+            value, position = next_token(code, position)
+            arguments = 0
+            value, position = next_token(code, position)
+            if value != ")":
+                arguments = 1
+                while value != ")":
+                    if value == ",":
+                        arguments += 1
+                    value, position = next_token(code, position)
+            if keyword == grammar.K_METHOD:
+                arguments += 1
+
+            value, position = next_token(code, position)
+            if value != "{":
+                raise ValueError("No symbol { found")
+            body = []
+            end = position
+            while len(body) < 4 and value != "}":
+                value, end = next_token(code, end)
+                body.append(value)
+            getter = keyword != grammar.K_CONSTRUCTOR and len(body) == 4 and \
+                is_getter(body)
+            signature["subroutines"][name] = [keyword, return_type, arguments,
+                                              getter]
+            position = end if getter else skip_body(code, position)
+
+        elif keyword == "}":
+            return signature
+        else:
+            raise ValueError("Unexpected " + keyword + " in class " +
+                             class_name)
+
+
+def next_token(code, position):
+    """
+    :param code: bytes-like source
+    :param position: offset to read from
+    :return: value of the next token and the offset after it
+    """
+    match = grammar.RE_TOKEN_COMPILED.match(code, position)
+    while match is not None and match.lastgroup == 'skip':
+        match = grammar.RE_TOKEN_COMPILED.match(code, match.end())
+    if match is None:
+        raise ValueError("Unexpected end of class")
+    if match.lastgroup == 'unterminated':
+        raise ValueError("Unterminated comment in line " +
+                         str(tokenizer.line_number(code, match.start())))
+    return str(match.group(), grammar.SOURCE_ENCODING), match.end()
+
+
+def skip_body(code, position):
+    """
+    :param code: bytes-like source
+    :param position: offset just after the opening brace of a body
+    :return: offset just after its closing brace
+    """
+    depth = 1
+    end = len(code)
+    while depth:
+        position = grammar.RE_SKIP_BODY_COMPILED.match(code, position).end()
+        if position >= end:
+            raise ValueError("No symbol } found")
+        brace = code[position:position + 1]
+        if brace == b"{":
+            depth += 1
+        elif brace == b"}":
+            depth -= 1
+        elif brace == b"/":
+            raise ValueError("Unterminated comment in line " +
+                             str(tokenizer.line_number(code, position)))
+        else:
+            raise ValueError("Unterminated string in line " +
+                             str(tokenizer.line_number(code, position)))
+        position += 1
+    return position
+
+
+def skim_tokens(tokens):
+    """
+    reads the signature of the class in an already tokenized file
+    :param tokens: TokenBuffer
+    :return: signature dict
+    """
+    value = tokens.value
+    ids = tokens.ids
+    end = len(tokens)
+    if end < 3 or value(0) != grammar.K_CLASS or value(2) != "{":
+        raise ValueError("No class found in the file")
+
+    open_id = tokens.name_ids.get(b"{")
+    close_id = tokens.name_ids.get(b"}")
+    comma_id = tokens.name_ids.get(b",")
+    signature = {"class": value(1), "fields": 0, "statics": 0,
+                 "subroutines": {}}
+
+    position = 3
+    while position < end:
+        keyword = value(position)
+        if keyword == grammar.K_STATIC or keyword == grammar.K_FIELD:
+            # static|field type name (, name)* ;
+            names = 1
+            position += 3
+            while position < end and value(position) != ";":
+                if ids[position] == comma_id:
+                    names += 1
+                position += 1
+            signature["statics" if keyword == grammar.K_STATIC
+                      else "fields"] += names
+            position += 1
+
+        elif keyword in (grammar.K_CONSTRUCTOR, grammar.K_FUNCTION,
+                         grammar.K_METHOD):
+            # kind type name ( parameters ) { body }
+            return_type = value(position + 1)
+            name = value(position + 2)
+            position += 4
+            arguments = 0
+            if value(position) != ")":
+                arguments = 1
+                while position < end and value(position) != ")":
+                    if ids[position] == comma_id:
+                        arguments += 1
+                    position += 1
+            if keyword == grammar.K_METHOD:
+                arguments += 1
+
+            # skip the body
+            position += 1
+            if position >= end or ids[position] != open_id:
+                raise ValueError("No symbol { found")
+            # string constants come without their quotes, "x" would pass
+            # for the variable x
+            getter = keyword != grammar.K_CONSTRUCTOR and \
+                position + 4 < end and \
+                tokens.kind(position + 2) in GETTER_KINDS and \
+                is_getter([value(position + offset) for offset in range(1, 5)])
+            signature["subroutines"][name] = [keyword, return_type, arguments,
+                                              getter]
+            depth = 0
+            while position < end:
+                token_id = ids[position]
+                if token_id == open_id:
+                    depth += 1
+                elif token_id == close_id:
+                    depth -= 1
+                    if depth == 0:
+                        break
+                position += 1
+            position += 1
+
+        elif keyword == "}":
+            return signature
+        else:
+            raise ValueError("Unexpected " + keyword + " in class " +
+                             signature["class"])
+
+    raise ValueError("No symbol } found")
+
+
+def is_getter(body):
+    """
+    :param body: values of the first four tokens of a subroutine body,
+    after its opening brace
+    :return: True if the body is only "return x;", x a variable, a
+    constant or this
+    """
+    keyword, returned, semicolon, brace = body
+    if keyword != grammar.K_RETURN or semicolon != ";" or brace != "}":
+        return False
+    if returned in grammar.keyword_constant or returned.isdigit():
+        return True
+    return grammar.RE_ID_COMPILED.match(returned) is not None and \
+        returned not in grammar.keywords
+
+
+def get_interface(signature):
+    """
+    :param signature: signature dict
+    :return: the signature as a tuple that can be hashed and compared
+    """
+    return (signature["class"], signature["fields"], signature["statics"],
+            tuple(sorted((name, tuple(subroutine)) for name, subroutine in
+                         signature["subroutines"].items())))
+
+
+class ClassIndex(object):
+    """
+    Signatures of the classes of a program, by class name
+    """
+    def __init__(self, classes=None):
+        """
+        :param classes: dict class name -> signature
+        """
+        self.classes = classes if classes is not None else {}
+
+    def add(self, signature):
+        """
+        adds or replaces the signature of a class
+        :param signature:
+        :return:
+        """
+        self.classes[signature["class"]] = signature
+
+    def has_class(self, class_name):
+        """
+        :param class_name:
+        :return: True if the class is part of the program
+        """
+        return class_name in self.classes
+
+    def get_subroutine(self, class_name, subroutine_name):
+        """
+        :param class_name:
+        :param subroutine_name:
+        :return: [kind, return type, number of arguments, getter], None if
+        unknown
+        """
+        signature = self.classes.get(class_name)
+        if signature is None:
+            return None
+        return signature["subroutines"].get(subroutine_name)
+
+    def save(self, path):
+        """
+        writes the index as json
+        :param path:
+        :return:
+        """
+        temp_name = path + "." + str(os.getpid())
+        with open(temp_name, 'w') as index_file:
+            json.dump(self.classes, index_file, sort_keys=True)
+        os.replace(temp_name, path)
+
+    @staticmethod
+    def load(path):
+        """
+        reads an index written by save
+        :param path:
+        :return: ClassIndex, empty if there is no readable index at path
+        """
+        try:
+            with open(path, 'r') as index_file:
+                return ClassIndex(json.load(index_file))
+        except (OSError, ValueError):
+            return ClassIndex()
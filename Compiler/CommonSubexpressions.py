@@ -0,0 +1,125 @@
+from Compiler.VMCode import Op, Segment
+import Compiler.Values as values
+
+# Common subexpression elimination, a VMwriter pass.
+#
+# The values the code of a function computes are followed (see Values).
+# When the same code computes a value again in the same basic block, and
+# nothing it reads changed in between, the first computation is kept and
+# its value stored in a local added to the function, the later ones push
+# that local instead:
+#   a[i] + a[i]   ->  push a, push i, add, pop pointer 1, push that 0,
+#                     pop local n, push local n, push local n, add
+#
+# Larger values are looked at first, so x.size() * x.size() reuses the whole
+# call and not only x. A call can only be reused if it has no effect: the
+# OS Math functions and getters (see ClassIndex).
+#
+# A value is only reused if that removes more instructions than storing it
+# adds, or if it calls a function: a call costs more than any store.
+
+STORE_SIZE = 2  # pop local n, push local n
+
+
+class CommonSubexpressions(values.ValuePass):
+    """
+    Computes the values a basic block computes more than once only once
+    """
+    def __init__(self, is_getter=None):
+        """
+        :param is_getter: see Values.ValuePass
+        """
+        values.ValuePass.__init__(self, is_getter)
+        # function name -> (instructions before, instructions after), for
+        # the functions in which values were reused
+        self.sizes = {}
+
+    def __call__(self, function, code):
+        """
+        reuses the values function computes more than once, in place
+        :param function: VMFunction
+        :param code: VMClass of the function
+        :return:
+        """
+        instructions = function.instructions()
+        end = len(instructions)
+        computed = {}  # code of a value -> Values computed by it, in order
+        for value in values.follow(instructions, 0, end, code.names,
+                                   self.is_pure, lambda uses: True):
+            if value.worth_saving():
+                computation = tuple(instructions[value.start:value.end])
+                computed.setdefault(computation, []).append(value)
+
+        replaced = {}  # start -> (end, local)
+        stored = {}  # end of a value kept -> local it is stored in
+        for computation, occurrences in sorted(
+                computed.items(),
+                key=lambda item: (-len(item[0]), item[1][0].start)):
+            # a value in code already replaced is gone
+            occurrences = [value for value in occurrences
+                           if not any(start <= value.start < replaced_end
+                                      for start, (replaced_end, local)
+                                      in replaced.items())]
+            chain = []
+            for value in occurrences:
+                if chain and self.is_available(instructions, chain[0], value,
+                                               code.names):
+                    if values.temps_unused(instructions, value, end):
+                        chain.append(value)
+                    continue
+                self.reuse(chain, computation, function, replaced, stored)
+                chain = [value]
+            self.reuse(chain, computation, function, replaced, stored)
+
+        if not replaced:
+            return
+        output = []
+        position = 0
+        while position < end:
+            if position in replaced:
+                position, local = replaced[position]
+                output.append((Op.PUSH, Segment.LOCAL, local))
+            else:
+                output.append(instructions[position])
+                position += 1
+            if position in stored:
+                output.append((Op.POP, Segment.LOCAL, stored[position]))
+                output.append((Op.PUSH, Segment.LOCAL, stored[position]))
+        function.set_instructions(output)
+        self.sizes[function.name] = (end, len(output))
+
+    def is_available(self, instructions, first, value, names):
+        """
+        :param instructions: list of (op, a, b) of the function
+        :param first: Value
+        :param value: Value computed by the same code, after first
+        :param names: names of the VMClass of the function
+        :return: True if value is always the value of first
+        """
+        for instruction in instructions[first.end:value.start]:
+            if instruction[0] == Op.LABEL or not first.uses.isdisjoint(
+                    values.changes(instruction, names, self.is_pure)):
+                return False
+        return True
+
+    def reuse(self, chain, computation, function, replaced, stored):
+        """
+        stores the first value of chain in a new local and replaces the
+        others by it, if that is worth it
+        :param chain: Values computed by the same code, the same value
+        :param computation: the code, tuple of (op, a, b)
+        :param function: VMFunction
+        :param replaced: start -> (end, local) of the values replaced
+        :param stored: end -> local of the values stored
+        :return:
+        """
+        if len(chain) < 2:
+            return
+        if all(op != Op.CALL for op, a, b in computation) and \
+                (len(chain) - 1) * (len(computation) - 1) <= STORE_SIZE:
+            return
+        local = function.n_locals
+        function.n_locals += 1
+        stored[chain[0].end] = local
+        for value in chain[1:]:
+            replaced[value.start] = (value.end, local)
@@ -3,6 +3,15 @@ import Compiler.JackTokenizer as tokenizer
 import Compiler.JackGrammar as grammar
 import Compiler.SymbolTable as symbol
 import Compiler.VMWriter as vmwriter
+import Compiler.ClassIndex as classindex
+import Compiler.Peephole as peephole
+import Compiler.DeadCode as deadcode
+import Compiler.LoopInvariant as loopinvariant
+import Compiler.CommonSubexpressions as commonsubexpressions
+import Compiler.Liveness as liveness
+import Compiler.Expression as expression
+import Compiler.StrengthReduction as strength
+from Compiler.VMCode import Op, Segment
 from collections import deque
 
 # This class does the compilation itself. It reads its input from a JackTokenizer
@@ -21,30 +30,236 @@ from collections import deque
 
 NEW_LINE = "\n"
 
+# optimizations that can be turned on, by name
+O_PEEPHOLE = "peephole"
+O_FOLD = "fold"
+O_PROPAGATION = "propagation"
+O_STRENGTH = "strength"
+O_STRING_POOL = "string-pool"
+O_DEAD_CODE = "dead-code"
+O_INLINE = "inline"
+O_TAIL_CALLS = "tail-calls"
+O_BRANCHES = "branches"
+O_ARRAY_ACCESS = "array-access"
+O_LOOP_INVARIANT = "loop-invariant"
+O_COMMON = "common-subexpressions"
+O_LIVENESS = "liveness"
+OPTIMIZATIONS = [O_FOLD, O_PROPAGATION, O_STRENGTH, O_STRING_POOL, O_BRANCHES,
+                 O_ARRAY_ACCESS, O_TAIL_CALLS, O_LOOP_INVARIANT, O_COMMON,
+                 O_INLINE, O_DEAD_CODE, O_LIVENESS, O_PEEPHOLE]
+# segments of the variables an array index may be read from
+VARIABLE_SEGMENTS = frozenset([Segment.LOCAL, Segment.ARGUMENT, Segment.THIS,
+                               Segment.STATIC])
+# optimizations that change what some programs do, left out of -O: pooled
+# string literals are shared, changing or disposing one changes every use
+OPT_IN = [O_STRING_POOL]
+# optimizations that also run over the whole program once every file is
+# compiled, see JackCompiler.link
+WHOLE_PROGRAM = [O_INLINE, O_DEAD_CODE]
+
+
+def copy_known(known):
+    """
+    :param known: what is known about the locals and arguments, see
+    CompilationEngine.known
+    :return: a copy that can change independently
+    """
+    return None if known is None else dict(known)
+
+
+def merge_known(condition, then_known, else_known):
+    """
+    :param condition: expression.Node of the condition of an if statement
+    :param then_known: what is known at the end of its statements
+    :param else_known: what is known at the end of its else statements, or
+    before the statement if there are none
+    :return: what is known after the if statement
+    """
+    # like the code, only true (-1) takes the statements
+    if condition.kind == expression.CONSTANT and \
+            condition.value == expression.TRUE:
+        return then_known
+    if condition.kind == expression.CONSTANT and \
+            condition.value == expression.FALSE:
+        return else_known
+    if then_known is None:
+        return else_known
+    if else_known is None:
+        return then_known
+    return dict((variable, value) for variable, value in then_known.items()
+                if variable in else_known and else_known[variable] == value)
+
+
+def index_of(code):
+    """
+    :param code: code of an array index
+    :return: (variable, constant) if the index is a local, argument, field or
+    static plus a constant, variable None if it is a constant, None if it is
+    anything else
+    """
+    variables = [(a, b) for op, a, b in code
+                 if op == Op.PUSH and a in VARIABLE_SEGMENTS]
+    constants = [b for op, a, b in code
+                 if op == Op.PUSH and a == Segment.CONSTANT]
+    if len(code) == 1 and code[0][0] == Op.PUSH:
+        if constants:
+            return None, constants[0]
+        if variables:
+            return variables[0], 0
+    if len(code) == 3 and code[2][0] == Op.ADD and len(variables) == 1 and \
+            len(constants) == 1:
+        return variables[0], constants[0]
+    return None
+
 
 class CompilationEngine(object):
-    def __init__(self, input_file, output_file):
+    def __init__(self, input_file, output_file, index=None,
+                 optimizations=(), precedence=grammar.JACK):
         """
         Creates a new compilation engine with the
         given input and output. The next routine
         called must be compileClass().
         :param input_file:
+        :param index: ClassIndex of the other classes of the program, used
+        to resolve and check calls to them
+        :param optimizations: names of the optimizations to apply, see
+        OPTIMIZATIONS
+        :param precedence: name of the operator precedence table, see
+        JackGrammar.precedences
         """
         self.tokenizer = tokenizer.JackTokenizer(input_file, output_file)
+        self.index = index if index is not None else classindex.ClassIndex()
         self.symbol_table = symbol.SymbolTable()
-        self.vm = vmwriter.VMwriter()
+        # operator -> its precedence, see compile_expression_tree
+        self.precedence = grammar.precedences[precedence]
+        self.optimizations = frozenset(optimizations)
+        self.fold = O_FOLD in self.optimizations
+        self.strength = O_STRENGTH in self.optimizations
+        # constants are left pending so they can be folded or multiplied by
+        self.defer_constants = self.fold or self.strength
+        self.propagation = O_PROPAGATION in self.optimizations
+        # what is known at the current point of the subroutine about its
+        # locals and arguments: variable (segment, index) -> the constant it
+        # holds, or the variable whose value it holds. None where the code
+        # can't be reached.
+        self.known = {}
+        self.tail_calls = O_TAIL_CALLS in self.optimizations
+        # label at the start of the current function when tail calls are
+        # turned into jumps, removed again if none is
+        self.entry_label = None
+        self.entry_used = False
+        self.branches = O_BRANCHES in self.optimizations
+        self.array_access = O_ARRAY_ACCESS in self.optimizations
+        # what pointer 1 was last set to: (array variable, index variable or
+        # None, constant added to the index, position after the pop), None
+        # if unknown. see that_offset
+        self.that = None
+        # string literal -> number of its static slot after the statics of
+        # the class, None when literals aren't pooled
+        self.string_pool = None
+        if O_STRING_POOL in self.optimizations:
+            self.string_pool = {}
+        passes = []
+        # None when loop invariant values aren't hoisted
+        self.loop_invariant = None
+        if O_LOOP_INVARIANT in self.optimizations:
+            self.loop_invariant = loopinvariant.LoopInvariant(self.is_getter)
+            passes.append((O_LOOP_INVARIANT, self.loop_invariant))
+        # None when common subexpressions aren't reused
+        self.common = None
+        if O_COMMON in self.optimizations:
+            self.common = commonsubexpressions.CommonSubexpressions(
+                self.is_getter)
+            passes.append((O_COMMON, self.common))
+        if O_DEAD_CODE in self.optimizations:
+            passes.append((O_DEAD_CODE, deadcode.remove_unreachable))
+        # None when dead stores aren't removed and locals not packed
+        self.liveness = None
+        if O_LIVENESS in self.optimizations:
+            self.liveness = liveness.Liveness(self.is_getter)
+            passes.append((O_LIVENESS, self.liveness))
+        if O_PEEPHOLE in self.optimizations:
+            passes.append((O_PEEPHOLE, peephole.Peephole()))
+            if O_DEAD_CODE in self.optimizations:
+                # folded branches leave labels no jump uses
+                passes.append((O_DEAD_CODE, deadcode.remove_unreachable))
+        self.vm = vmwriter.VMwriter(output_file, passes=passes)
         self.input = input_file  # already open :)
         self.output = output_file  # already open :)
         self.class_name = "" # current class name
         self.current_subroutine_type = 0
         self.current_subroutine_name = ""
-        self.type_list = [grammar.K_INT, grammar.K_CHAR, grammar.K_BOOLEAN]
+        self.type_list = list(grammar.primitive_types)
         self.label_counter = 0
-        self.if_counter = 0
-        self.while_counter = 0
-        self.tokenizer.advance()
-        self.symbol_tables = []
-        self.compile_class()
+        self.dependencies = set() # other classes whose subroutines are called
+        try:
+            # the signature of this class is known before its body is
+            # compiled, so calls to subroutines declared further down
+            # resolve as well
+            self.signature = classindex.skim_tokens(self.tokenizer.tokens)
+            self.tokenizer.advance()
+            self.compile_class()
+        finally:
+            # the source may be memory mapped, it is only read while the
+            # class is compiled
+            self.tokenizer.close()
+
+    def get_report(self):
+        """
+        :return: dict function name -> optimization -> number of VM
+        instructions its pass removed from the function
+        """
+        return dict((name, dict(removed))
+                    for name, removed in self.vm.removed.items())
+
+    def get_loop_invariant_report(self):
+        """
+        :return: dict function name -> number of values hoisted out of its
+        loops, for the functions that have any
+        """
+        if self.loop_invariant is None:
+            return {}
+        return dict(self.loop_invariant.hoisted)
+
+    def get_common_report(self):
+        """
+        :return: dict function name -> (VM instructions before, after) of
+        the functions in which common subexpressions were reused
+        """
+        if self.common is None:
+            return {}
+        return dict(self.common.sizes)
+
+    def get_liveness_report(self):
+        """
+        :return: dict function name -> (locals before, locals after, dead
+        stores removed) of the functions liveness changed
+        """
+        if self.liveness is None:
+            return {}
+        return dict(self.liveness.sizes)
+
+    def get_subroutine(self, class_name, subroutine_name):
+        """
+        :param class_name:
+        :param subroutine_name:
+        :return: [kind, return type, number of arguments, getter] of the
+        subroutine, None if it is not part of the program (an OS class for
+        example)
+        """
+        if class_name == self.class_name:
+            return self.signature["subroutines"].get(subroutine_name)
+        return self.index.get_subroutine(class_name, subroutine_name)
+
+    def is_getter(self, function_name):
+        """
+        :param function_name: Class.subroutine
+        :return: True if the subroutine is part of the program and only
+        returns a variable or a constant, see ClassIndex
+        """
+        class_name, _, subroutine_name = function_name.partition(".")
+        subroutine = self.get_subroutine(class_name, subroutine_name)
+        return subroutine is not None and subroutine[classindex.S_GETTER]
 
 
     def compile_class(self):
@@ -63,10 +278,7 @@ class CompilationEngine(object):
         self.tokenizer.advance()
         # add class type to list of types
         self.type_list.append(self.tokenizer.current_value)
-        self.compile_identifier()
-
-        # Create new symbol table
-        self.symbol_tables.append(symbol.SymbolTable)
+        self.class_name = self.compile_identifier()
 
         # {
         self.tokenizer.advance()
@@ -87,9 +299,7 @@ class CompilationEngine(object):
 
         # }
         self.checkSymbol("}")
-
-        # TODO delete SymbolTable
-        self.symbol_tables.pop()
+        self.vm.flush()
 
 
     def compile_class_var_dec(self, raise_error=True):
@@ -112,6 +322,7 @@ class CompilationEngine(object):
                 return False
 
         self.compile_declaration(kind)
+        return True
 
 
     def compile_subroutine_var_dec(self, raise_error=True):
@@ -131,6 +342,7 @@ class CompilationEngine(object):
                 return False
 
         self.compile_declaration(kind)
+        return True
 
 
 
@@ -151,8 +363,7 @@ class CompilationEngine(object):
         name = self.compile_identifier()
 
         # add to symbol table
-        self.symbol_table.define(name, type, kind) # TODO
-        self.symbol_tables[self.last_pos()].define(name, type, kind)
+        self.symbol_table.define(name, type, kind)
 
 
         # (',' varName)*
@@ -179,12 +390,12 @@ class CompilationEngine(object):
         #TODO : check if 2 different kinds can be in the same line
         while (more_vars):
             # ','
-            if self.tokenizer.get_next()[0] == ",":
+            if self.tokenizer.peek_value() == ",":
 
                 self.tokenizer.advance() # ,
 
                 # type (if applicable)
-                if self.tokenizer.get_next()[0] in self.type_list: #new type
+                if self.tokenizer.peek_value() in self.type_list: #new type
 
                     self.tokenizer.advance()
                     type = self.compile_type(False)
@@ -197,7 +408,6 @@ class CompilationEngine(object):
 
                 # add to symbol table
                 self.symbol_table.define(name, type, kind)
-                self.symbol_tables[self.last_pos()].define(name, type, kind)
 
             else:
                 more_vars = False
@@ -208,10 +418,11 @@ class CompilationEngine(object):
         """
         HADAR
 
-        checks that current_value in type list
+        checks that current_value is a type: one of the type list or a
+        class name
         :return: type
         """
-        if self.tokenizer.current_value in self.type_list:
+        if self.is_type():
             return self.tokenizer.current_value
         else:
             if raise_error:
@@ -296,13 +507,10 @@ class CompilationEngine(object):
 
         #open symbol table
 
-        self.symbol_table.start_subroutine() # TODO
-        # create new symbol table
-        self.symbol_tables.append(symbol.SymbolTable)
+        self.symbol_table.start_subroutine()
 
         if self.current_subroutine_type == grammar.K_METHOD:
-            self.symbol_table.define('this', self.class_name, grammar.K_ARG) # TODO
-            self.symbol_tables[self.last_pos()].define('this', self.class_name, grammar.K_ARG)
+            self.symbol_table.define('this', self.class_name, symbol.Kind.arg)
 
         # (
         self.tokenizer.advance()
@@ -310,9 +518,7 @@ class CompilationEngine(object):
 
         # parameterList
         self.tokenizer.advance()
-        if self.compile_parameter_list() is not False:
-            self.tokenizer.advance()
-        else:
+        if self.compile_parameter_list() is False:
             if raise_error:
                 raise ValueError("illegal parameter list in subroutine")
             return False
@@ -322,9 +528,11 @@ class CompilationEngine(object):
 
         # subroutine body
         self.tokenizer.advance()
+        self.compile_subroutineBody()
+        if self.entry_label is not None and not self.entry_used:
+            self.vm.function.delete(0, 1)
 
-        # TODO delete symbolTable
-        self.symbol_tables.pop()
+        return True
 
 
     def compile_subroutineBody(self):
@@ -383,16 +591,28 @@ class CompilationEngine(object):
         :return:
         """
 
-        # TODO symbol table needs to be fixed ?
         self.vm.writeFunction(self.get_vm_function_name(),
-                              self.symbol_table.varCount(grammar.K_VAR))
+                              self.symbol_table.varCount(symbol.Kind.var))
+        self.entry_label = None
+        self.entry_used = False
+        self.that = None
+        self.known = {}
+        if self.propagation:
+            # the VM and tail calls zero the locals
+            for local in range(self.symbol_table.varCount(symbol.Kind.var)):
+                self.known[(grammar.LOCAL, local)] = 0
+        if self.tail_calls:
+            # before a method sets this, a tail call may be on another
+            # object
+            self.entry_label = self.get_new_label()
+            self.vm.WriteLabel(self.entry_label)
 
         if self.current_subroutine_type == grammar.K_METHOD:
             self.vm.writePush(grammar.K_ARG, 0) # push argument 0
             self.vm.writePop(grammar.POINTER, 0) # pop pointer 0
         elif self.current_subroutine_type == grammar.K_CONSTRUCTOR:
             # push size of object
-            self.vm.writePush(grammar.CONST, self.symbol_table.varCount(grammar.field))
+            self.vm.writePush(grammar.CONST, self.symbol_table.varCount(symbol.Kind.field))
             # call Memory.alloc 1
             self.vm.writeCall('Memory.alloc', 1)
             # pop pointer 0
@@ -408,36 +628,34 @@ class CompilationEngine(object):
         including the enclosing {}.
         :return:
         """
+        # labels may be jumped to from code setting pointer 1 differently
+        self.that = None
         more_statements = True
         # (statement)*
         while (more_statements):
-            # TODO :ask ruthi about there lines
-            if self.tokenizer.current_value == "/":
-                self.tokenizer.advance()
-                self.output.write(self.tokenizer.get_next()[0])
-
-            if self.tokenizer.current_value == "if":
+            statement = self.tokenizer.current_value
+            if statement == "if":
                 self.compile_if()
                 self.tokenizer.advance()
 
-            elif self.tokenizer.current_value == "let":
+            elif statement == "let":
                 self.compile_let()
                 self.tokenizer.advance()
 
-            elif self.tokenizer.current_value == "while":
+            elif statement == "while":
                 self.compile_while()
                 self.tokenizer.advance()
 
-            elif self.tokenizer.current_value == "do":
+            elif statement == "do":
                 self.compile_do()
                 self.tokenizer.advance()
 
-            elif self.tokenizer.current_value == "return":
+            elif statement == "return":
                 self.compile_return()
                 self.tokenizer.advance()
             else:
                 more_statements = False
-
+        self.that = None
 
 
 
@@ -456,7 +674,7 @@ class CompilationEngine(object):
 
         :return: true if void or type, false otherwise
         """
-        return (self.tokenizer.current_value == grammar.K_VOID) or self.tokenizer.current_value in self.type_list
+        return (self.tokenizer.current_value == grammar.K_VOID) or self.is_type()
 
 
 
@@ -480,7 +698,7 @@ class CompilationEngine(object):
 
         :return:
         """
-        more_parameters = True
+        more_parameters = self.tokenizer.current_value != ')'
         while more_parameters:
             if self.is_type():
                 type = self.tokenizer.current_value
@@ -488,14 +706,17 @@ class CompilationEngine(object):
                 if self.tokenizer.current_token_type == grammar.IDENTIFIER:
                     name = self.tokenizer.current_value
                     #add to symbol table
-                    self.symbol_table.define(name, type, grammar.K_ARG) # TODO
-                    self.symbol_tables[self.last_pos()].define(name, type, grammar.K_ARG)
+                    self.symbol_table.define(name, type, symbol.Kind.arg)
                     self.tokenizer.advance()
 
                     if self.tokenizer.current_value == ',':
                         self.tokenizer.advance()
                     elif self.tokenizer.current_value == ')':
                         more_parameters = False
+                    else:
+                        return False
+                else:
+                    return False
 
             else:
                 return False
@@ -504,20 +725,15 @@ class CompilationEngine(object):
 
 
     def is_type(self):
-        """ Checks if the type of the current type is in the type_list
+        """ Checks if the current value is in the type_list or is a class
+        name
         """
 
-        return (self.tokenizer.current_value in self.type_list)
+        return (self.tokenizer.current_value in self.type_list or
+                self.tokenizer.current_token_type == grammar.IDENTIFIER)
 
 
 
-    def compile_statements(self):
-        """
-        Compiles a sequence of statements, not
-        including the enclosing {}.
-        :return:
-        """
-
     def checkSymbol(self, symbol, raise_error=True):
         """ Check if the symbol is in the current value"""
         if self.tokenizer.current_value == symbol:
@@ -525,6 +741,7 @@ class CompilationEngine(object):
         else:
             if raise_error:
                 raise ValueError("No symbol " + symbol + " found")
+            return False
 
     def compile_if(self):
         """
@@ -533,7 +750,9 @@ class CompilationEngine(object):
         Compiles an if statement, possibly with a trailing else clause.
         :return:
         """
-        self.if_counter += 1
+        else_label = self.get_new_label()
+        end_label = self.get_new_label()
+        self.that = None
 
         # (
         self.tokenizer.advance()
@@ -541,10 +760,15 @@ class CompilationEngine(object):
 
         # expression
         self.tokenizer.advance()
-        self.compile_expression(True, True)
+        if self.branches:
+            # the jump is written once it is known if there is an else
+            condition = self.take_condition()
+            node = condition[0]
+        else:
+            node = self.compile_expression()
 
-        self.vm.WriteArithmetic('neg')
-        self.vm.WriteIf("L_" + self.if_counter.__str__() + "_1")
+            self.vm.WriteArithmetic('not')
+            self.vm.WriteIf(else_label)
 
         # )
         self.tokenizer.advance()
@@ -556,34 +780,63 @@ class CompilationEngine(object):
 
         # statements
         self.tokenizer.advance()
+        then_start = len(self.vm.function)
+        known = self.known
+        self.known = copy_known(known)
         self.compile_statements()
-
-        self.vm.WriteGoto("L_" + self.if_counter.__str__() + "_2")
-        self.vm.WriteLabel("L_" + self.if_counter.__str__() + "_1")
+        then_known = self.known
+        else_known = known
 
         # }
         self.checkSymbol("}")
 
         # (else {statement})?
-        else_param = False
-
-        if self.tokenizer.get_next()[0] == "else":
+        if self.tokenizer.peek_value() == "else":
+            # the jump on the raw value is only right for true (-1) and
+            # false (0): if-goto would take any other value for true
+            rotated = self.branches and node.is_boolean()
+            if rotated:
+                # the condition jumps to the statements, the else
+                # statements come first and fall through
+                then_label = else_label
+                then_code = self.vm.function.cut(then_start)
+                self.write_condition(condition, True, then_label)
+            else:
+                if self.branches:
+                    then_code = self.vm.function.cut(then_start)
+                    self.write_condition(condition, False, else_label)
+                    self.write_code(then_code)
+                self.vm.WriteGoto(end_label)
+                self.vm.WriteLabel(else_label)
+
+            # else
             self.tokenizer.advance()
-            if self.tokenizer.current_value == "else":
-                else_param = True
-        if (else_param):
+
             # {
             self.tokenizer.advance()
             self.checkSymbol("{")
 
             # statement
             self.tokenizer.advance()
+            self.known = copy_known(known)
             self.compile_statements()
+            else_known = self.known
 
             # }
             self.checkSymbol("}")
 
-            self.vm.WriteLabel("L_" + self.if_counter.__str__() + "_2")
+            if rotated:
+                self.vm.WriteGoto(end_label)
+                self.vm.WriteLabel(then_label)
+                self.write_code(then_code)
+            self.vm.WriteLabel(end_label)
+        else:
+            if self.branches:
+                then_code = self.vm.function.cut(then_start)
+                self.write_condition(condition, False, else_label)
+                self.write_code(then_code)
+            self.vm.WriteLabel(else_label)
+        self.known = merge_known(node, then_known, else_known)
 
     def compile_while(self):
         """
@@ -592,7 +845,15 @@ class CompilationEngine(object):
         Compiles a while statement.
         :return:
         """
-        self.while_counter += 1
+        start_label = self.get_new_label()
+        end_label = self.get_new_label()
+        self.that = None
+        # the condition and the statements may run after any iteration
+        if self.propagation and self.known is not None:
+            for name in self.assigned_variables():
+                if self.is_tracked(name):
+                    self.forget(self.get_variable(name))
+        known = self.known
 
         # (
         self.tokenizer.advance()
@@ -600,10 +861,24 @@ class CompilationEngine(object):
         # expression
         self.tokenizer.advance()
 
-        self.vm.WriteLabel("L_" + self.while_counter.__str__() + "_1")
-        self.compile_expression()
-        self.vm.WriteArithmetic('neg')
-        self.vm.WriteIf("L_" + self.while_counter.__str__() + "_2")
+        rotated = False
+        if self.branches:
+            condition = self.take_condition()
+            # jumping back on the raw value is only right for true and false
+            rotated = condition[0].is_boolean()
+        if rotated:
+            # the condition is tested at the bottom and jumps back to the
+            # statements, end_label is where it starts
+            self.vm.WriteGoto(end_label)
+            self.vm.WriteLabel(start_label)
+        elif self.branches:
+            self.vm.WriteLabel(start_label)
+            self.write_condition(condition, False, end_label)
+        else:
+            self.vm.WriteLabel(start_label)
+            self.compile_expression()
+            self.vm.WriteArithmetic('not')
+            self.vm.WriteIf(end_label)
 
         # )
         self.tokenizer.advance()
@@ -615,15 +890,138 @@ class CompilationEngine(object):
 
         # statement
         self.tokenizer.advance()
+        self.known = copy_known(known)
         self.compile_statements()
+        # the loop ends at its condition
+        self.known = known
 
-        self.vm.WriteGoto("L_" + self.while_counter.__str__() + "_1")
-        self.vm.WriteLabel("L_" + self.while_counter.__str__() + "_2")
+        if rotated:
+            self.vm.WriteLabel(end_label)
+            self.write_condition(condition, True, start_label)
+        else:
+            self.vm.WriteGoto(start_label)
+            self.vm.WriteLabel(end_label)
 
         # }
         self.checkSymbol("}")
 
 
+    def take_condition(self):
+        """
+        compiles the condition of an if or a while and takes its code out
+        of the function again, to be written by write_condition
+        :return: the condition: its expression.Node, its code and the
+        position the code was at
+        """
+        start = len(self.vm.function)
+        node = self.compile_expression()
+        return node, self.vm.function.cut(start), start
+
+    def write_code(self, code):
+        """
+        :param code: instructions to add at the end of the function
+        :return:
+        """
+        append = self.vm.function.append
+        for op, a, b in code:
+            append(op, a, b)
+
+    def write_condition(self, condition, jump_if, label):
+        """
+        writes a condition taken by take_condition as a conditional jump
+        :param condition: node, code and position of the condition
+        :param jump_if: True to jump if the condition holds, False to jump
+        if it doesn't
+        :param label: where to jump
+        :return:
+        """
+        node, code, start = condition
+        self.write_jump(node, jump_if, label, code, start)
+
+    def write_jump(self, node, jump_if, label, code, start):
+        """
+        writes code that jumps to label if the value of node is jump_if,
+        without computing the boolean value where it can. like the
+        unoptimized code, only true (-1) holds: jump_if True is only right
+        for nodes that are boolean (see Node.is_boolean).
+        - a constant condition is a goto or nothing
+        - ~c jumps on c the other way
+        - & and | of comparisons are short-circuited, if the operand that
+          may be skipped calls nothing
+        - x < k and x > k jump on the opposite comparison with k -/+ 1
+          instead of negating the result
+        :param node: expression.Node
+        :param jump_if: True or False
+        :param label: where to jump
+        :param code: the code node is part of
+        :param start: position code started at when node was compiled
+        :return:
+        """
+        def node_code(node):
+            return code[node.start - start:node.end - start]
+
+        if node.kind == expression.CONSTANT:
+            if (node.value == expression.TRUE) == jump_if:
+                self.vm.WriteGoto(label)
+            return
+
+        if node.kind == expression.UNARY and node.op == "~" and \
+                node.left.is_boolean():
+            self.write_jump(node.left, not jump_if, label, code, start)
+            return
+
+        if node.kind == expression.BINARY and node.op in ("&", "|") and \
+                node.is_boolean() and \
+                all(op != Op.CALL for op, a, b in node_code(node.right)):
+            if (node.op == "&") != jump_if:
+                # false & ... jumps when false, true | ... when true
+                self.write_jump(node.left, jump_if, label, code, start)
+                self.write_jump(node.right, jump_if, label, code, start)
+            else:
+                skip_label = self.get_new_label()
+                self.write_jump(node.left, not jump_if, skip_label, code,
+                                start)
+                self.write_jump(node.right, jump_if, label, code, start)
+                self.vm.WriteLabel(skip_label)
+            return
+
+        if node.kind == expression.BINARY and node.op in ("<", ">") and \
+                not jump_if:
+            inverted = self.invert_comparison(node)
+            if inverted is not None:
+                operand, op, value = inverted
+                self.write_code(node_code(operand))
+                self.write_code(self.constant_code(value))
+                self.write_operator(op)
+                self.vm.WriteIf(label)
+                return
+
+        self.write_code(node_code(node))
+        if not jump_if:
+            self.vm.WriteArithmetic('not')
+        self.vm.WriteIf(label)
+
+    def invert_comparison(self, node):
+        """
+        :param node: expression.Node of x < k, x > k, k < x or k > x
+        :return: x and the comparison with a constant that is true when
+        node is false, None if no operand is a constant
+        """
+        left, right = node.left, node.right
+        if right.kind == expression.CONSTANT:
+            # x < k  ->  x > k - 1,  x > k  ->  x < k + 1
+            if node.op == "<" and right.value > expression.MIN_INT:
+                return left, ">", right.value - 1
+            if node.op == ">" and right.value < expression.MAX_INT:
+                return left, "<", right.value + 1
+        elif left.kind == expression.CONSTANT:
+            # k < x  ->  x < k + 1,  k > x  ->  x > k - 1
+            if node.op == "<" and left.value < expression.MAX_INT:
+                return right, "<", left.value + 1
+            if node.op == ">" and left.value > expression.MIN_INT:
+                return right, ">", left.value - 1
+        return None
+
     def compile_let(self):
         """
         RUTHI
@@ -636,44 +1034,189 @@ class CompilationEngine(object):
         varName = self.compile_identifier()
 
         # get varName from SymbolTable
-        position = self.last_pos()
-        while self.symbol_tables[position].indexOf(varName) == symbol.NO_INDEX:
-            position -= 1
-        varName_index = self.symbol_tables[position].indexOf(varName)
+        segment, varName_index = self.get_variable(varName)
 
         # [
-        advance_token = False
         self.tokenizer.advance()
-        check_expression = False
-        if self.checkSymbol("[", False):
-            check_expression = True
-        if check_expression:
-            # expression
+        is_array = self.checkSymbol("[", False)
+        if is_array:
+            # varName + expression
+            address_start = len(self.vm.function)
+            self.vm.writePush(segment, varName_index)
             self.tokenizer.advance()
-            self.compile_expression(True, True)
+            self.compile_expression()
+            self.vm.WriteArithmetic('add')
+            address_end = len(self.vm.function)
             # ]
             self.tokenizer.advance()
             self.checkSymbol("]")
-            advance_token = True
+            self.tokenizer.advance()
 
         # =
-        if (advance_token):
-            self.tokenizer.advance()
         self.checkSymbol("=")
 
         # expression
         self.tokenizer.advance()
-        self.compile_expression(True, True)
+        node = self.compile_expression()
 
         # ;
         self.tokenizer.advance()
         self.checkSymbol(";")
 
-        # push varName
-        segment = self.symbol_tables[position].kindOf(varName)
-        self.vm.writePop(segment, varName_index)
+        if is_array:
+            address = self.vm.function.instructions(address_start,
+                                                    address_end)
+            offset = self.that_offset(address, address_start)
+            if offset is not None:
+                # pointer 1 already points at or before the entry
+                self.vm.function.delete(address_start, address_end)
+                self.vm.writePop(grammar.THAT, offset)
+                return
+            # the value may have used that, so the address is set only now
+            self.vm.writePop(grammar.TEMP, 0)
+            self.vm.writePop(grammar.POINTER, 1)
+            self.set_that(address)
+            self.vm.writePush(grammar.TEMP, 0)
+            self.vm.writePop(grammar.THAT, 0)
+        else:
+            # pop varName
+            self.vm.writePop(segment, varName_index)
+            if self.is_tracked(varName):
+                self.assign((segment, varName_index), node)
+
+    def is_tracked(self, name):
+        """
+        :param name: variable name
+        :return: True if what the variable holds is propagated: locals and
+        arguments, that nothing but a let statement of the subroutine can
+        change
+        """
+        return self.propagation and self.symbol_table.kindOf(name) in \
+            (symbol.Kind.var, symbol.Kind.arg)
+
+    def assign(self, variable, node):
+        """
+        records what a let statement stored in a local or an argument
+        :param variable: (segment, index)
+        :param node: expression.Node of the value stored
+        :return:
+        """
+        if self.known is None:
+            return
+        self.forget(variable)
+        if node.kind == expression.CONSTANT:
+            self.known[variable] = node.value
+        elif node.variable is not None and node.variable != variable:
+            self.known[variable] = node.variable
+
+    def forget(self, variable):
+        """
+        drops what is known about a variable that changes, and about the
+        variables known to hold its value
+        :param variable: (segment, index)
+        :return:
+        """
+        self.known.pop(variable, None)
+        for other, value in list(self.known.items()):
+            if value == variable:
+                del self.known[other]
+
+    def assigned_variables(self):
+        """
+        looks ahead over the while statement being compiled, from its
+        condition to its closing brace
+        :return: set of the names let statements in it assign to, array
+        entries aside
+        """
+        tokens = self.tokenizer.tokens
+        ids = tokens.ids
+        let_id = tokens.name_ids.get(grammar.K_LET.encode())
+        open_id = tokens.name_ids.get(b"{")
+        close_id = tokens.name_ids.get(b"}")
+        bracket_id = tokens.name_ids.get(b"[")
+        assigned = set()
+        depth = 0
+        end = len(tokens)
+        for position in range(self.tokenizer.position, end):
+            token_id = ids[position]
+            if token_id == open_id:
+                depth += 1
+            elif token_id == close_id:
+                depth -= 1
+                if depth == 0:
+                    break
+            elif token_id == let_id and position + 2 < end and \
+                    ids[position + 2] != bracket_id:
+                assigned.add(tokens.value(position + 1))
+        return assigned
+
+    def set_that(self, address):
+        """
+        records what the pop pointer 1 just written set it to
+        :param address: code of the address: push of the array variable,
+        the index and add
+        :return:
+        """
+        index = index_of(address[1:-1])
+        if not self.array_access or index is None:
+            self.that = None
+            return
+        op, segment, base = address[0]
+        self.that = ((segment, base),) + index + (len(self.vm.function),)
+
+    def that_offset(self, address, start):
+        """
+        an entry at a constant distance after the one pointer 1 was last
+        set to, by the same code, is that k: pointer 1 needs no new value if
+        nothing since changed it, the array or the index variable
+        :param address: code of the address of an array entry: push of the
+        array variable, the index and add
+        :param start: position the code is at
+        :return: k if the entry is that k, None otherwise
+        """
+        if self.that is None:
+            return None
+        index = index_of(address[1:-1])
+        if index is None:
+            return None
+        base, variable, constant, set_at = self.that
+        op, segment, array = address[0]
+        if (base, variable) != ((segment, array), index[0]) or \
+                index[1] < constant:
+            return None
+        variables = set([base, variable]) - set([None])
+        memory = any(segment == Segment.THIS or segment == Segment.STATIC
+                     for segment, number in variables)
+        function = self.vm.function
+        first = min(start, set_at)
+        if set_at > len(function):
+            return None
+        for position, (op, a, b) in enumerate(function.instructions(first),
+                                              first):
+            if op == Op.LABEL or op == Op.GOTO or op == Op.IF_GOTO or \
+                    op == Op.CALL or op == Op.RETURN:
+                return None
+            if op != Op.POP:
+                continue
+            if a == Segment.POINTER and (b == 0 or position >= set_at) or \
+                    (a, b) in variables or memory and \
+                    (a == Segment.THIS or a == Segment.STATIC or
+                     a == Segment.THAT):
+                return None
+        return index[1] - constant
+
+    def get_variable(self, name):
+        """
+        looks a variable up in the symbol table
+        :param name: variable name
+        :return: VM segment and index of the variable
+        """
+        kind = self.symbol_table.kindOf(name)
+        if kind == symbol.NO_KIND:
+            raise ValueError("Unknown variable " + name)
+        return kind.get_seg(), self.symbol_table.indexOf(name)
 
-    def compile_term(self, tags=True, check=False):
+    def compile_term(self):
         """
         Compiles a term. This routine is faced with a slight difficulty when
         trying to decide between some of the alternative parsing rules.
@@ -683,52 +1226,55 @@ class CompilationEngine(object):
         suffices to distinguish between the three possibilities.
         Any other token is not part of this term and should not be advanced
         over.
-        :return:
+        :return: expression.Node of the term, False if there is no term
         """
 
         # Integer constant, String constant, keyword constant
         type = self.tokenizer.token_type()
         if (type == grammar.INT_CONST):
-            if check:
-                return True
-            self.vm.writePush(grammar.CONST, "")
+            return self.compile_constant(int(self.tokenizer.int_val()))
         elif (type == grammar.KEYWORD and self.tokenizer.keyword() in grammar.keyword_constant):
-            if check:
-                return True # TODO what are we suppose to return here?
+            keyword = self.tokenizer.keyword()
+            if keyword == grammar.K_TRUE:
+                return self.compile_constant(expression.TRUE)
+            elif keyword != grammar.K_THIS:
+                return self.compile_constant(expression.FALSE)
+            self.compile_keyword_constant(keyword)
         elif type == grammar.STRING_CONS:
-            if check:
-                return True
-                # TODO what are we suppose to return here?
+            self.compile_string_constant(self.tokenizer.string_val())
         # ( expression )
         elif self.tokenizer.current_value == "(":
-            if check:
-                return True
             self.checkSymbol("(")
             self.tokenizer.advance()
-            self.compile_expression(True, True)
+            node = self.compile_expression_tree()
             self.tokenizer.advance()
             self.checkSymbol(")")
+            return node
 
         # unaryOp term
         elif self.tokenizer.current_value in grammar.unaryOp:
-            if check:
-                return True
             op = self.tokenizer.current_value
             self.checkSymbol(self.tokenizer.current_value)
             self.tokenizer.advance()
-            self.compile_term()
+            operand = self.set_span(len(self.vm.function), self.compile_term())
+            if not self.fold:
+                self.write_pending(operand)
+            if operand.pending:
+                return expression.Node(
+                    expression.CONSTANT,
+                    expression.fold_unary(op, operand.value), pending=True)
             # op
-            self.vm.output_file.write(op)
+            self.vm.WriteArithmetic(grammar.unary_op_2_command[op])
+            return expression.Node(expression.UNARY, op=op, left=operand)
 
         # varName ([ expression ])?
         elif type == grammar.IDENTIFIER:
-            if check:
-                return True
-            # push varName
-            self.vm.writePush(self.tokenizer.current_value, "")
 
-            if self.tokenizer.get_next()[0] == "[":
-                self.compile_identifier()
+            next_value = self.tokenizer.peek_value()
+            if next_value == "[":
+                # push varName
+                address_start = len(self.vm.function)
+                self.vm.writePush(*self.get_variable(self.compile_identifier()))
                 self.tokenizer.advance()
 
                 if self.checkSymbol("[", False):
@@ -736,67 +1282,363 @@ class CompilationEngine(object):
                     self.compile_expression()
                     self.tokenizer.advance()
                     self.checkSymbol("]")
-            elif (self.tokenizer.get_next()[0] == "(") or (self.tokenizer.get_next()[0] == "."):
+                self.vm.WriteArithmetic('add')
+                if self.array_access:
+                    address = self.vm.function.cut(address_start)
+                    offset = self.that_offset(address, address_start)
+                    if offset is not None:
+                        self.vm.writePush(grammar.THAT, offset)
+                        return expression.Node(expression.VALUE)
+                    self.write_code(address)
+                address = self.vm.function.instructions(address_start)
+                self.vm.writePop(grammar.POINTER, 1)
+                self.set_that(address)
+                self.vm.writePush(grammar.THAT, 0)
+            elif next_value == "(" or next_value == ".":
                 # subroutineCall
                 self.subroutineCall()
+            else:
+                return self.compile_variable(self.compile_identifier())
 
         else:
             return False
 
-        return True
+        return expression.Node(expression.VALUE)
 
-    def compile_expression(self, tags=True, term_tag=False, expression_lst=False):
+    def compile_variable(self, name):
         """
-        RUTHI
+        compiles a variable read. a local or argument known to hold a
+        constant is compiled as that constant, one known to hold the value
+        of another variable reads that variable.
+        :param name: variable name
+        :return: expression.Node
+        """
+        variable = self.get_variable(name)
+        node = expression.Node(expression.VALUE)
+        if self.is_tracked(name):
+            value = self.known.get(variable) if self.known else None
+            if isinstance(value, int):
+                return self.compile_constant(value)
+            if value is not None:
+                variable = value
+            node.variable = variable
+        # push varName
+        self.vm.writePush(*variable)
+        return node
+
+    def compile_constant(self, value):
+        """
+        compiles an integer or keyword constant. when folding or reducing
+        strength, no code is written for it yet, see write_pending.
+        :param value: int
+        :return: expression.Node
+        """
+        if self.defer_constants:
+            return expression.Node(expression.CONSTANT, value, pending=True)
+        if value == expression.TRUE:
+            self.compile_keyword_constant(grammar.K_TRUE)
+        else:
+            # propagated constants may be negative
+            self.write_code(self.constant_code(value))
+        return expression.Node(expression.CONSTANT, value)
+
+    def constant_code(self, value):
+        """
+        :param value: 16 bit int
+        :return: instructions pushing value
+        """
+        if value >= 0:
+            return [(Op.PUSH, Segment.CONSTANT, value)]
+        # ~value is never negative, even for -32768
+        return [(Op.PUSH, Segment.CONSTANT, ~value), (Op.NOT, 0, 0)]
+
+    def write_pending(self, node, position=None):
+        """
+        writes the code of a pending constant
+        :param node: expression.Node
+        :param position: where to insert it in the current function, at
+        its end if None
+        :return: number of instructions written
+        """
+        if not node.pending:
+            return 0
+        node.pending = False
+        function = self.vm.function
+        if position is None:
+            position = len(function)
+        code = self.constant_code(node.value)
+        function.insert(position, code)
+        node.start = position
+        node.end = position + len(code)
+        return len(code)
+
+    def set_span(self, start, node):
+        """
+        records where the code of a node just compiled is
+        :param start: position in the current function its code starts at
+        :param node: expression.Node
+        :return: node
+        """
+        if not node.pending:
+            node.start = start
+            node.end = len(self.vm.function)
+        return node
 
-        Compiles an expression.
+    def combine(self, op, left, right, position):
+        """
+        completes the code of left op right, folding it if both sides are
+        constant
+        :param op: binary operator
+        :param left: expression.Node
+        :param right: expression.Node
+        :param position: where the code of right starts in the current
+        function
+        :return: expression.Node of left op right
+        """
+        node = expression.Node(expression.BINARY, op=op, left=left,
+                               right=right)
+        if left.pending and right.pending and self.fold:
+            value = expression.fold(op, left.value, right.value)
+            if value is not None:
+                return expression.Node(expression.CONSTANT, value,
+                                       pending=True)
+        if self.strength:
+            code = self.reduce_strength(op, left, right)
+            if code is not None:
+                # the constant operand is never pushed
+                start = position if left.pending else left.start
+                for instruction in code:
+                    self.vm.function.append(*instruction)
+                return self.set_span(start, node)
+        # the code of left goes before the code of right
+        right.shift(self.write_pending(left, position))
+        self.write_pending(right)
+        self.write_operator(op)
+        return self.set_span(left.start, node)
+
+    def reduce_strength(self, op, left, right):
+        """
+        :param op: binary operator
+        :param left: expression.Node
+        :param right: expression.Node
+        :return: instructions computing left op right from the value of the
+        operand that isn't a pending constant, None if the OS has to
+        """
+        if op == "*":
+            if right.pending and not left.pending:
+                return strength.multiply_code(right.value)
+            if left.pending and not right.pending:
+                return strength.multiply_code(left.value)
+        elif op == "/" and right.pending and not left.pending:
+            bound = strength.upper_bound(left)
+            if bound is not None:
+                return strength.divide_code(right.value, bound)
+        return None
+
+    def compile_keyword_constant(self, keyword):
+        """
+        pushes true (-1), false, null (0) or this
+        :param keyword:
         :return:
         """
-        expression_counter = 0
+        if keyword == grammar.K_THIS:
+            self.vm.writePush(grammar.POINTER, 0)
+        else:
+            self.vm.writePush(grammar.CONST, 0)
+            if keyword == grammar.K_TRUE:
+                self.vm.WriteArithmetic('not')
 
-        # term
-        if self.compile_term(False, True) is False:
-            return False
+    def compile_string_constant(self, string):
+        """
+        builds a new String object holding string. when literals are
+        pooled, every distinct literal of the class is built once, the
+        first time it is used, and kept in a static slot of its own. code
+        changing or disposing a literal then changes it for every use.
+        :param string:
+        :return:
+        """
+        if self.string_pool is not None:
+            slot = self.string_pool.get(string)
+            if slot is None:
+                slot = self.string_pool[string] = len(self.string_pool)
+            index = self.signature["statics"] + slot
+            built_label = self.get_new_label()
+            self.vm.writePush(grammar.K_STATIC, index)
+            self.vm.WriteIf(built_label)
+            self.write_new_string(string)
+            self.vm.writePop(grammar.K_STATIC, index)
+            self.vm.WriteLabel(built_label)
+            self.vm.writePush(grammar.K_STATIC, index)
         else:
-            if expression_lst:
-                return True
-            self.compile_term()
+            self.write_new_string(string)
+
+    def write_new_string(self, string):
+        """
+        writes the code building a new String object holding string
+        :param string:
+        :return:
+        """
+        self.vm.writePush(grammar.CONST, len(string))
+        self.vm.writeCall('String.new', 1)
+        for char in string:
+            self.vm.writePush(grammar.CONST, ord(char))
+            self.vm.writeCall('String.appendChar', 2)
+
+    def write_operator(self, op):
+        """
+        writes the VM code of a binary operator
+        :param op:
+        :return:
+        """
+        if op in grammar.op_2_function:
+            self.vm.writeCall(grammar.op_2_function[op], 2)
+        else:
+            self.vm.WriteArithmetic(grammar.op_2_command[op])
+
+    def compile_expression(self):
+        """
+        RUTHI
+
+        Compiles an expression, its value is left on the stack.
+        :return: expression.Node of the expression
+        """
+        node = self.compile_expression_tree()
+        self.write_pending(node)
+        return node
+
+    def compile_expression_tree(self, min_precedence=None):
+        """
+        Compiles an expression by precedence climbing: the term, then every
+        operator that binds at least as tight as min_precedence, with the
+        operators binding tighter than it on its right as its right
+        operand. with Jack's single precedence every right operand is a
+        term. a constant value may be left pending
+        :param min_precedence: precedence of the loosest operator taken, all
+        are if None
+        :return: expression.Node of the expression
+        """
+        # term
+        start = len(self.vm.function)
+        node = self.compile_term()
+        if node is False:
+            raise ValueError("Expected an expression before " +
+                             self.tokenizer.current_value)
+        self.set_span(start, node)
 
         # (op term)*
-        while self.tokenizer.get_next()[0] in grammar.operators:
+        precedence = self.precedence.get(self.tokenizer.peek_value())
+        while precedence is not None and \
+                (min_precedence is None or precedence >= min_precedence):
             self.tokenizer.advance()
-            self.checkSymbol(self.tokenizer.current_value)
+            op = self.tokenizer.current_value
             self.tokenizer.advance()
-            self.compile_term()
+            position = len(self.vm.function)
+            right = self.compile_expression_tree(precedence + 1)
+            node = self.combine(op, node, right, position)
+            precedence = self.precedence.get(self.tokenizer.peek_value())
 
-        return expression_counter
+        return node
 
     def compile_expression_list(self):
         """
         Compiles a (possibly empty) comma separated list of expressions.
-        :return:
+        :return: number of expressions
         """
+        expressions = 0
 
         # expression?
-        if self.compile_expression(False, False, True) is not False:
+        if self.tokenizer.current_value != ")" or \
+                self.tokenizer.token_type() != grammar.SYMBOL:
             # (',' expression)*
-            self.compile_expression(True, True)
+            self.compile_expression()
+            expressions += 1
             self.tokenizer.advance()
             while self.tokenizer.current_value == ',':
                 self.checkSymbol(",")
                 # expression
                 self.tokenizer.advance()
-                self.compile_expression(True, True)
+                self.compile_expression()
+                expressions += 1
                 self.tokenizer.advance()
 
+        return expressions
 
-    def last_pos(self):
+    def subroutineCall(self):
         """
-        RUTHI
+        Compiles a subroutine call:
+        subroutineName ( expressionList ) |
+        (className | varName) . subroutineName ( expressionList )
 
-        :return: position of the last symbol table in the array
+        calls on a variable are method calls, the object is pushed as
+        argument 0. a call without a class name calls a subroutine of this
+        class, a method if the signature doesn't say otherwise.
+        :return:
         """
-        return len(self.symbol_tables) - 1
+        name = self.compile_identifier()
+        arguments = 0
+
+        self.tokenizer.advance()
+        if self.tokenizer.current_value == ".":
+            # subroutineName
+            self.tokenizer.advance()
+            subroutine_name = self.compile_identifier()
+            self.tokenizer.advance()
+
+            if self.symbol_table.kindOf(name) != symbol.NO_KIND:
+                # varName . methodName
+                class_name = self.symbol_table.typeOf(name)
+                if class_name in grammar.primitive_types:
+                    raise ValueError(name + " of type " + class_name +
+                                     " has no methods")
+                subroutine = self.get_subroutine(class_name, subroutine_name)
+                if subroutine is not None and \
+                        subroutine[classindex.S_KIND] != grammar.K_METHOD:
+                    raise ValueError(class_name + "." + subroutine_name +
+                                     " is not a method")
+                self.vm.writePush(*self.get_variable(name))
+                arguments += 1
+            else:
+                # className . subroutineName
+                class_name = name
+                subroutine = self.get_subroutine(class_name, subroutine_name)
+                if subroutine is not None and \
+                        subroutine[classindex.S_KIND] == grammar.K_METHOD:
+                    raise ValueError("Method " + class_name + "." +
+                                     subroutine_name + " called without an object")
+            if subroutine is None and (class_name == self.class_name or
+                                       self.index.has_class(class_name)):
+                raise ValueError("Class " + class_name + " has no subroutine "
+                                 + subroutine_name)
+        else:
+            # subroutineName of this class
+            class_name = self.class_name
+            subroutine_name = name
+            subroutine = self.get_subroutine(class_name, subroutine_name)
+            if subroutine is None:
+                raise ValueError("Class " + class_name + " has no subroutine "
+                                 + subroutine_name)
+            if subroutine[classindex.S_KIND] == grammar.K_METHOD:
+                if self.current_subroutine_type == grammar.K_FUNCTION:
+                    raise ValueError("Method " + subroutine_name +
+                                     " called from a function")
+                self.vm.writePush(grammar.POINTER, 0)
+                arguments += 1
+
+        # ( expressionList )
+        self.checkSymbol("(")
+        self.tokenizer.advance()
+        arguments += self.compile_expression_list()
+        self.checkSymbol(")")
+
+        if subroutine is not None and \
+                subroutine[classindex.S_ARGS] != arguments:
+            raise ValueError(class_name + "." + subroutine_name + " expects " +
+                             str(subroutine[classindex.S_ARGS]) +
+                             " arguments, got " + str(arguments))
+
+        if class_name != self.class_name:
+            self.dependencies.add(class_name)
+        self.vm.writeCall(class_name + "." + subroutine_name, arguments)
 
     def compile_do(self):
         """
@@ -810,6 +1652,9 @@ class CompilationEngine(object):
         self.tokenizer.advance()
         self.subroutineCall()
 
+        # the returned value is not used
+        self.vm.writePop(grammar.TEMP, 0)
+
         # ;
         self.tokenizer.advance()
         self.checkSymbol(";")
@@ -823,16 +1668,71 @@ class CompilationEngine(object):
         :return:
         """
 
+        function = self.vm.function
         # expression?
-        if self.tokenizer.get_next()[0] != ";":
+        if self.tokenizer.peek_value() != ";":
             self.tokenizer.advance()
             self.compile_expression()
             self.tokenizer.advance()
             self.checkSymbol(";")
+            # return f(...)
+            if self.is_tail_call(len(function) - 1):
+                self.write_tail_call(len(function) - 1)
+                self.known = None
+                return
         else:
             # ;
             self.tokenizer.advance()
             self.checkSymbol(";")
+            # do f(...); return; in a void f, whose value is always 0
+            subroutine = self.signature["subroutines"][
+                self.current_subroutine_name]
+            if subroutine[classindex.S_TYPE] == grammar.K_VOID and \
+                    len(function) and function.ops[-1] == Op.POP and \
+                    function.a[-1] == Segment.TEMP and \
+                    self.is_tail_call(len(function) - 2):
+                self.write_tail_call(len(function) - 2)
+                self.known = None
+                return
+            # void functions return 0
+            self.vm.writePush(grammar.CONST, 0)
+
+        self.vm.writeReturn()
+        self.known = None
+
+    def is_tail_call(self, position):
+        """
+        :param position: index of an instruction in the current function
+        :return: True if it is a call of the current subroutine that can be
+        turned into a jump to its start
+        """
+        function = self.vm.function
+        if not self.tail_calls or position < 0 or \
+                self.current_subroutine_type == grammar.K_CONSTRUCTOR or \
+                function.ops[position] != Op.CALL:
+            return False
+        arguments = self.signature["subroutines"][
+            self.current_subroutine_name][classindex.S_ARGS]
+        return self.vm.code.names[function.a[position]] == \
+            self.get_vm_function_name() and function.b[position] == arguments
 
-        # TODO don't forget abt return 0
-
+    def write_tail_call(self, position):
+        """
+        replaces the call at position, the last thing the current subroutine
+        does, by a jump to its start: the arguments of the call become the
+        arguments of the function and the locals are zeroed again. a
+        method starts again by setting this, so the call may be on another
+        object.
+        :param position: index of the call in the current function
+        :return:
+        """
+        function = self.vm.function
+        arguments = function.b[position]
+        function.truncate(position)
+        for argument in reversed(range(arguments)):
+            self.vm.writePop(grammar.K_ARG, argument)
+        for local in range(self.symbol_table.varCount(symbol.Kind.var)):
+            self.vm.writePush(grammar.CONST, 0)
+            self.vm.writePop(grammar.LOCAL, local)
+        self.entry_used = True
+        self.vm.WriteGoto(self.entry_label)
@@ -0,0 +1,98 @@
+from Compiler.VMCode import Op
+
+# Dead code elimination.
+#   remove_unreachable  VMwriter pass: drops the code after a goto or a
+#                       return that no jump leads back into, and labels no
+#                       jump uses. statements after a return end up here.
+#   shake               whole program: drops the functions no call chain
+#                       from the entry points reaches.
+
+ENTRY_POINTS = ["Sys.init", "Main.main"]
+# a program may bring its own OS classes. the OS calls their functions
+# (Sys.init calls Math.init, String.new calls Memory.alloc, ...) where the
+# program doesn't, so all of them are kept.
+OS_CLASSES = frozenset(["Array", "Keyboard", "Math", "Memory", "Output",
+                        "Screen", "String", "Sys"])
+
+
+def remove_unreachable(function, code=None):
+    """
+    removes the unreachable instructions of function in place
+    :param function: VMFunction
+    :param code: VMClass of the function, not needed
+    :return:
+    """
+    instructions = function.instructions()
+    changed = False
+    while True:
+        targets = set(a for op, a, b in instructions
+                      if op == Op.GOTO or op == Op.IF_GOTO)
+        output = []
+        reachable = True
+        for instruction in instructions:
+            op = instruction[0]
+            if op == Op.LABEL:
+                if instruction[1] not in targets:
+                    continue
+                reachable = True
+            elif not reachable:
+                continue
+            output.append(instruction)
+            if op == Op.GOTO or op == Op.RETURN:
+                reachable = False
+        # dropped jumps may leave more labels unused
+        if len(output) == len(instructions):
+            break
+        instructions = output
+        changed = True
+    if changed:
+        function.set_instructions(instructions)
+
+
+def calls(function, code):
+    """
+    :param function: VMFunction
+    :param code: VMClass of the function
+    :return: set of the names of the functions it calls
+    """
+    names = code.names
+    return set(names[a] for op, a in zip(function.ops, function.a)
+               if op == Op.CALL)
+
+
+def shake(classes):
+    """
+    removes the functions of a program that can't be reached from its
+    entry points or the OS classes it brings. nothing is removed from a
+    program without an entry point.
+    :param classes: list of VMClass, the whole program
+    :return: dict name -> size of every function removed
+    """
+    functions = {}
+    for code in classes:
+        for function in code.functions:
+            functions[function.name] = (function, code)
+
+    if not any(name in functions for name in ENTRY_POINTS):
+        return {}
+    pending = [name for name in functions if name in ENTRY_POINTS or
+               name.partition(".")[0] in OS_CLASSES]
+    reached = set(pending)
+    while pending:
+        function, code = functions[pending.pop()]
+        for name in calls(function, code):
+            # OS functions aren't part of the program
+            if name in functions and name not in reached:
+                reached.add(name)
+                pending.append(name)
+
+    removed = {}
+    for code in classes:
+        kept = []
+        for function in code.functions:
+            if function.name in reached:
+                kept.append(function)
+            else:
+                removed[function.name] = len(function) + 1
+        code.functions = kept
+    return removed
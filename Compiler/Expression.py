@@ -0,0 +1,143 @@
+# Expression trees built while an expression is compiled, and folding of
+# constant subexpressions.
+#
+# The code of a subexpression that has to run is written as it is parsed,
+# its node only describes it. A constant can instead be left pending: no
+# code is written for it until the caller knows it can't be folded into the
+# node above (see CompilationEngine.combine).
+#
+# Every node also keeps where its code is in the function being written,
+# start and end, so it can be taken out and written again differently (see
+# CompilationEngine.take_condition). A pending constant has no code yet.
+#
+# Values are those of the 16 bit target: folding wraps around like the
+# hardware and the OS functions would.
+
+CONSTANT = 0  # a known value
+VALUE = 1  # a variable, call, array entry, string or this
+UNARY = 2
+BINARY = 3
+
+WORD = 0x10000
+MIN_INT = -0x8000
+MAX_INT = 0x7FFF
+TRUE = -1
+FALSE = 0
+
+
+class Node(object):
+    """
+    A subexpression
+    """
+    __slots__ = ("kind", "value", "op", "left", "right", "pending", "start",
+                 "end", "variable")
+
+    def __init__(self, kind, value=None, op=None, left=None, right=None,
+                 pending=False):
+        """
+        :param kind: CONSTANT, VALUE, UNARY or BINARY
+        :param value: the value of a constant
+        :param op: operator of a unary or binary node
+        :param left: operand of a unary node, left operand of a binary one
+        :param right: right operand of a binary node
+        :param pending: True if the code of the constant isn't written yet
+        """
+        self.kind = kind
+        self.value = value
+        self.op = op
+        self.left = left
+        self.right = right
+        self.pending = pending
+        self.start = None
+        self.end = None
+        # (segment, index) of the local or argument a VALUE node only reads
+        self.variable = None
+
+    def is_constant(self):
+        return self.kind == CONSTANT
+
+    def is_boolean(self):
+        """
+        :return: True if the value is always true (-1) or false (0), so
+        & and | on it are logical
+        """
+        if self.kind == CONSTANT:
+            return self.value == TRUE or self.value == FALSE
+        if self.kind == UNARY:
+            return self.op == "~" and self.left.is_boolean()
+        if self.kind == BINARY:
+            if self.op in ("<", ">", "="):
+                return True
+            if self.op in ("&", "|"):
+                return self.left.is_boolean() and self.right.is_boolean()
+        return False
+
+    def shift(self, offset):
+        """
+        moves the code of the node and its operands
+        :param offset: number of instructions inserted before it
+        :return:
+        """
+        if self.start is not None:
+            self.start += offset
+            self.end += offset
+        if self.left is not None:
+            self.left.shift(offset)
+        if self.right is not None:
+            self.right.shift(offset)
+
+
+def wrap(value):
+    """
+    :param value: int
+    :return: value as a signed 16 bit word
+    """
+    value &= WORD - 1
+    return value - WORD if value > MAX_INT else value
+
+
+def fold(op, left, right):
+    """
+    :param op: binary operator
+    :param left: value of the left operand
+    :param right: value of the right operand
+    :return: value of left op right, None if it can't be known at compile
+    time
+    """
+    if op == "+":
+        return wrap(left + right)
+    if op == "-":
+        return wrap(left - right)
+    if op == "*":
+        return wrap(left * right)
+    if op == "/":
+        # Math.divide errors at run time on 0 and overflows on -32768
+        if right == 0 or left == MIN_INT or right == MIN_INT:
+            return None
+        quotient = abs(left) // abs(right)
+        return -quotient if (left < 0) != (right < 0) else quotient
+    if op == "&":
+        return wrap(left & right)
+    if op == "|":
+        return wrap(left | right)
+    # comparisons subtract on the target, folded only when that can't
+    # overflow
+    if MIN_INT <= left - right <= MAX_INT:
+        if op == "<":
+            return TRUE if left < right else FALSE
+        if op == ">":
+            return TRUE if left > right else FALSE
+        if op == "=":
+            return TRUE if left == right else FALSE
+    return None
+
+
+def fold_unary(op, operand):
+    """
+    :param op: - or ~
+    :param operand: value of the operand
+    :return: value of op operand
+    """
+    if op == "-":
+        return wrap(-operand)
+    return wrap(~operand)
@@ -0,0 +1,161 @@
+from Compiler.VMCode import Op, Segment
+
+# Inlining of small leaf subroutines, run over the whole program once every
+# class is compiled: a call can only be inlined once the code of the
+# subroutine called is known, and it is usually in another class.
+#
+# A call to a subroutine that calls nothing and is short enough is replaced
+# by its body. The arguments are popped from the stack into locals added to
+# the caller, the locals of the subroutine get locals of their own, its
+# labels are renamed and its returns jump to the end of the body, leaving
+# the return value on the stack like the call did. pointer 0 and 1 are
+# saved around the body if it changes them (methods set this), so the
+# caller's this and that are the ones it had. temp holds nothing across a
+# call, it needs no saving.
+#
+# The locals added for different call sites of the same caller are shared,
+# none of them holds anything once the inlined body ends.
+
+DEFAULT_MAX_SIZE = 12  # instructions of a body, after the method prologue
+
+
+class Inliner(object):
+    """
+    Inlines the calls to small leaf subroutines of a program
+    """
+    def __init__(self, classes, max_size=DEFAULT_MAX_SIZE):
+        """
+        :param classes: list of VMClass, the whole program
+        :param max_size: largest body inlined, in VM instructions
+        """
+        self.max_size = max_size
+        self.functions = {}  # name -> (VMFunction, VMClass)
+        for code in classes:
+            for function in code.functions:
+                self.functions[function.name] = (function, code)
+        self.inlined = {}  # name of a caller -> calls inlined in it
+        self.site_counter = 0
+
+    def get_body(self, name, caller_code):
+        """
+        :param name: function called
+        :param caller_code: VMClass of the caller
+        :return: (instructions, VMClass, number of locals) of the function
+        if it can be inlined in caller_code, None otherwise
+        """
+        if name not in self.functions:
+            return None
+        function, code = self.functions[name]
+        instructions = function.instructions()
+        size = len(instructions)
+        if instructions[:2] == [(Op.PUSH, Segment.ARGUMENT, 0),
+                                (Op.POP, Segment.POINTER, 0)]:
+            size -= 2
+        if size > self.max_size:
+            return None
+        for op, a, b in instructions:
+            if op == Op.CALL:
+                return None
+            # statics belong to the file of the class
+            if (op == Op.PUSH or op == Op.POP) and a == Segment.STATIC and \
+                    code is not caller_code:
+                return None
+        return instructions, code, function.n_locals
+
+    def run(self, function, code):
+        """
+        inlines the calls of function that can be
+        :param function: VMFunction
+        :param code: VMClass of the function
+        :return: number of calls inlined
+        """
+        names = code.names
+        output = []
+        base = function.n_locals
+        n_locals = base
+        inlined = 0
+        for instruction in function.instructions():
+            op, a, b = instruction
+            body = None
+            if op == Op.CALL:
+                body = self.get_body(names[a], code)
+            if body is None:
+                output.append(instruction)
+                continue
+            used = self.expand(body, b, base, code, output)
+            n_locals = max(n_locals, base + used)
+            inlined += 1
+
+        if inlined:
+            function.set_instructions(output)
+            function.n_locals = n_locals
+            self.inlined[function.name] = inlined
+        return inlined
+
+    def expand(self, body, n_args, base, code, output):
+        """
+        appends the inlined body of a call to output
+        :param body: (instructions, VMClass, number of locals) of the
+        function called
+        :param n_args: number of arguments of the call
+        :param base: first local of the caller free for the body
+        :param code: VMClass of the caller
+        :param output: instructions of the caller
+        :return: number of locals of the caller the body uses
+        """
+        instructions, callee_code, callee_locals = body
+        first_local = base + n_args
+        saved = base + n_args + callee_locals
+        pointers = sorted(set(b for op, a, b in instructions
+                              if op == Op.POP and a == Segment.POINTER))
+        self.site_counter += 1
+        suffix = ".i" + str(self.site_counter)
+        end_label = code.intern("INLINE" + suffix)
+
+        for argument in reversed(range(n_args)):
+            output.append((Op.POP, Segment.LOCAL, base + argument))
+        for number, pointer in enumerate(pointers):
+            output.append((Op.PUSH, Segment.POINTER, pointer))
+            output.append((Op.POP, Segment.LOCAL, saved + number))
+        for local in range(callee_locals):
+            output.append((Op.PUSH, Segment.CONSTANT, 0))
+            output.append((Op.POP, Segment.LOCAL, first_local + local))
+
+        jumps_to_end = False
+        last = len(instructions) - 1
+        for position, (op, a, b) in enumerate(instructions):
+            if op == Op.PUSH or op == Op.POP:
+                if a == Segment.ARGUMENT:
+                    a, b = Segment.LOCAL, base + b
+                elif a == Segment.LOCAL:
+                    b += first_local
+            elif op == Op.LABEL or op == Op.GOTO or op == Op.IF_GOTO:
+                a = code.intern(callee_code.names[a] + suffix)
+            elif op == Op.RETURN:
+                if position == last:
+                    continue
+                op, a, b = Op.GOTO, end_label, 0
+                jumps_to_end = True
+            output.append((op, a, b))
+        if jumps_to_end:
+            output.append((Op.LABEL, end_label, 0))
+
+        for number, pointer in enumerate(pointers):
+            output.append((Op.PUSH, Segment.LOCAL, saved + number))
+            output.append((Op.POP, Segment.POINTER, pointer))
+        return n_args + callee_locals + len(pointers)
+
+
+def inline(classes, max_size=DEFAULT_MAX_SIZE):
+    """
+    inlines the calls to small leaf subroutines in every function of a
+    program
+    :param classes: list of VMClass, the whole program
+    :param max_size: largest body inlined, in VM instructions
+    :return: dict name of a caller -> calls inlined in it
+    """
+    inliner = Inliner(classes, max_size)
+    for code in classes:
+        for function in code.functions:
+            inliner.run(function, code)
+    return inliner.inlined
@@ -1,49 +1,479 @@
 import sys, os, os.path, glob, re
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import Compiler.CompilationEngine as engine
+import Compiler.JackGrammar as grammar
+import Compiler.BuildCache as buildcache
+import Compiler.ClassIndex as classindex
+import Compiler.VMCode as vmcode
+import Compiler.DeadCode as deadcode
+import Compiler.Inliner as inliner
 
 
-def analyze(files_to_process):
+# ClassIndex of the program, optimizations and operator precedence in
+# codegen worker processes, set once per worker by init_worker instead of
+# being sent with every file
+worker_index = None
+worker_optimizations = ()
+worker_precedence = grammar.JACK
+
+
+def init_worker(index, optimizations=(), precedence=grammar.JACK):
+    """
+    pool initializer of the codegen workers
+    :param index: ClassIndex of the program, only read
+    :param optimizations: names of the optimizations to apply
+    :param precedence: name of the operator precedence table
+    :return:
     """
-    for each jack file in files_to_process:
+    global worker_index, worker_optimizations, worker_precedence
+    worker_index = index
+    worker_optimizations = optimizations
+    worker_precedence = precedence
 
+
+def compile_file(input_file_name, index=None, optimizations=None,
+                 precedence=None):
+    """
     - Create a tokenizer from the Xxx.jack file
     - Create a VM-writer into the Xxx.vm file
     - Compile(INPUT: tokenizer, OUTPUT: VM-writer)
+    :param input_file_name: path of the file to compile
+    :param index: ClassIndex of the program, the one set by init_worker if
+    None
+    :param optimizations: names of the optimizations to apply, the ones set
+    by init_worker if None
+    :param precedence: name of the operator precedence table, the one set by
+    init_worker if None
+    :return: error message (None if the file compiled) and the class info:
+    its name, the classes it depends on, the number of instructions every
+    pass removed from each function, the number of values hoisted out of
+    its loops, the size of the functions in which common subexpressions
+    were reused, before and after, and the locals and dead stores liveness
+    removed
+    """
+    if index is None:
+        index = worker_index
+    if optimizations is None:
+        optimizations = worker_optimizations
+    if precedence is None:
+        precedence = worker_precedence
+    output_file_name = get_output_file_name(input_file_name)
+    # the output is written aside and renamed into place once the file
+    # compiled, a failed compile leaves the previous Xxx.vm as it was
+    temp_name = output_file_name + "." + str(os.getpid())
+
+    compiled = None
+    try:
+        with open(input_file_name, 'rb') as input_file, \
+                open(temp_name, 'w') as output_file:
+            compiled = engine.CompilationEngine(input_file, output_file, index,
+                                                optimizations, precedence)
+    except ValueError as error:
+        return input_file_name + ": " + str(error), None
+    finally:
+        if compiled is None and os.path.exists(temp_name):
+            os.remove(temp_name)
+    os.replace(temp_name, output_file_name)
+
+    info = {"class": compiled.class_name,
+            "dependencies": sorted(compiled.dependencies),
+            "removed": compiled.get_report(),
+            "hoisted": compiled.get_loop_invariant_report(),
+            "common": compiled.get_common_report(),
+            "locals": compiled.get_liveness_report()}
+    return None, info
+
+
+def skim_file(input_file_name):
+    """
+    reads the signature of the class in a jack file
+    :param input_file_name:
+    :return: error message (None if the file was read) and the signature
+    """
+    try:
+        with open(input_file_name, 'rb') as input_file:
+            return None, classindex.skim(input_file)
+    except ValueError as error:
+        return input_file_name + ": " + str(error), None
+
+
+class BuildReport(object):
+    """
+    What the optimizations did to a build
+    """
+    def __init__(self):
+        # function name -> optimization -> VM commands its pass removed
+        # from the function
+        self.removed = {}
+        # function name -> VM commands of the functions removed as unused
+        self.unused = {}
+        self.inlined = {}  # function name -> calls inlined in it
+        # function name -> values hoisted out of its loops
+        self.hoisted = {}
+        # function name -> VM commands before and after common
+        # subexpressions were reused in it
+        self.common = {}
+        # function name -> locals before and after liveness and the dead
+        # stores it removed
+        self.locals = {}
+        # VM commands and functions of the program before and after the
+        # whole program optimizations, None if they didn't run
+        self.size_before = None
+        self.size_after = None
+
+
+def get_output_file_name(input_file_name):
+    """
+    :param input_file_name: Xxx.jack
+    :return: Xxx.vm
+    """
+    return os.path.splitext(input_file_name)[0] + ".vm"
+
+
+def run_jobs(function, items, jobs, initializer=None, initargs=()):
+    """
+    calls function on every item, by a pool of processes if there is more
+    than one job
+    :param function: module level function, so it can be sent to workers
+    :param items:
+    :param jobs: number of processes to use
+    :param initializer: called once in every worker
+    :param initargs: arguments of initializer
+    :return: list of results, in the order of items
+    """
+    if jobs > 1 and len(items) > 1:
+        workers = min(jobs, len(items))
+        with ProcessPoolExecutor(max_workers=workers, initializer=initializer,
+                                 initargs=initargs) as pool:
+            # map keeps the order of items
+            return list(pool.map(function, items,
+                                 chunksize=max(1, len(items) // (workers * 4))))
+    if initializer is not None:
+        initializer(*initargs)
+    return [function(item) for item in items]
+
+
+def compile_files(files_to_process, jobs=1, index=None, optimizations=(),
+                  precedence=grammar.JACK):
+    """
+    compiles each jack file in files_to_process. with more than one job the
+    files are compiled by a pool of processes, the index is sent to every
+    worker once and only read.
+    :param files_to_process: paths of files to process
+    :param jobs: number of processes to use
+    :param index: ClassIndex of the program
+    :param optimizations: names of the optimizations to apply
+    :param precedence: name of the operator precedence table
+    :return: list of compile_file results, in the order of files_to_process
+    """
+    if jobs > 1:
+        return run_jobs(compile_file, files_to_process, jobs, init_worker,
+                        (index, optimizations, precedence))
+    return [compile_file(input_file_name, index, optimizations, precedence)
+            for input_file_name in files_to_process]
+
+
+def build_index(files_to_process, keys, cache=None, jobs=1):
+    """
+    skims every file into a class index, by a pool of processes if there is
+    more than one job. with a cache, the signatures of files that didn't
+    change come from the index saved by the last build.
     :param files_to_process: paths of files to process
+    :param keys: cache key of every file (empty without a cache)
+    :param cache: BuildCache or None
+    :param jobs: number of processes to use
+    :return: ClassIndex and dict file -> error message of files that could
+    not be skimmed
+    """
+    index = classindex.ClassIndex()
+    errors = {}
+    saved = {}
+    if cache is not None:
+        for signature in cache.load_index().classes.values():
+            saved[signature.get("key")] = signature
+
+    signatures = {}
+    to_skim = []
+    for input_file_name in files_to_process:
+        key = keys.get(input_file_name)
+        if key is not None and key in saved:
+            signatures[input_file_name] = saved[key]
+        else:
+            to_skim.append(input_file_name)
+
+    for input_file_name, (error, signature) in \
+            zip(to_skim, run_jobs(skim_file, to_skim, jobs)):
+        if error is not None:
+            errors[input_file_name] = error
+        else:
+            signature["key"] = keys.get(input_file_name)
+            signatures[input_file_name] = signature
+
+    # merged in file order, so a duplicate class name resolves the same way
+    # whatever the number of jobs
+    for input_file_name in files_to_process:
+        if input_file_name in signatures:
+            index.add(signatures[input_file_name])
+    return index, errors
+
+
+def link(files_to_process, optimizations, report=None,
+         inline_size=inliner.DEFAULT_MAX_SIZE):
+    """
+    runs the whole program optimizations over the compiled outputs of all
+    files, a .vm file is rewritten only if it changed
+    :param files_to_process: paths of the jack files of the program
+    :param optimizations: names of the optimizations to apply
+    :param report: BuildReport or None
+    :param inline_size: largest subroutine body inlined, in VM instructions
     :return:
     """
+    outputs = []
     for input_file_name in files_to_process:
-        file_name = os.path.splitext(input_file_name)[0]
-        output_file_name = file_name + ".vm"
+        output_file_name = get_output_file_name(input_file_name)
+        with open(output_file_name, 'r') as output_file:
+            text = output_file.read()
+        outputs.append((output_file_name, text, vmcode.parse(text)))
+    classes = [code for output_file_name, text, code in outputs]
+    size_before = (sum(vmcode.size(code) for code in classes),
+                   sum(len(code.functions) for code in classes))
 
-        input_file = open(input_file_name,'r')
-        output_file = open(output_file_name,'w')
+    inlined = {}
+    if engine.O_INLINE in optimizations:
+        inlined = inliner.inline(classes, inline_size)
+    # subroutines inlined everywhere are dropped here
+    removed = {}
+    if engine.O_DEAD_CODE in optimizations:
+        removed = deadcode.shake(classes)
 
+    for output_file_name, text, code in outputs:
+        linked = vmcode.serialize(code)
+        if linked != text:
+            with open(output_file_name, 'w') as output_file:
+                output_file.write(linked)
 
+    if report is not None:
+        report.inlined.update(inlined)
+        report.unused.update(removed)
+        report.size_before = size_before
+        report.size_after = (sum(vmcode.size(code) for code in classes),
+                             sum(len(code.functions) for code in classes))
 
 
-def main(path):
+def analyze(files_to_process, jobs=1, cache=None, optimizations=(),
+            report=None, whole_program=False,
+            inline_size=inliner.DEFAULT_MAX_SIZE, precedence=grammar.JACK):
+    """
+    compiles each jack file in files_to_process, in two phases that both
+    run in parallel with more than one job: all files are skimmed first,
+    then every file is compiled against the merged signatures of the whole
+    program, so calls between classes are resolved and checked.
+
+    with a cache, a file is only compiled if its source (or the compiler)
+    changed, or if the interface of a class it depends on changed since it
+    was compiled. otherwise its output is restored from the cache.
+    :param files_to_process: paths of files to process
+    :param jobs: number of processes to use
+    :param cache: BuildCache or None
+    :param optimizations: names of the optimizations to apply
+    :param report: BuildReport filled in by the build, if given
+    :param whole_program: True if files_to_process are all the files of
+    the program, so the whole program optimizations can run
+    :param inline_size: largest subroutine body inlined, in VM instructions
+    :param precedence: name of the operator precedence table
+    :return: list of error messages, in the order of files_to_process
+    """
+    optimizations = sorted(optimizations)
+    keys = {}
+    if cache is not None:
+        options = ",".join(optimizations)
+        if precedence != grammar.JACK:
+            options += " precedence=" + precedence
+        for input_file_name in files_to_process:
+            with open(input_file_name, 'rb') as input_file:
+                keys[input_file_name] = cache.key(input_file.read(), options)
+
+    index, errors = build_index(files_to_process, keys, cache, jobs)
+    to_compile = [input_file_name for input_file_name in files_to_process
+                  if input_file_name not in errors]
+
+    if cache is not None:
+        interfaces = dict(
+            (class_name, buildcache.interface_hash(classindex.get_interface(
+                signature))) for class_name, signature in index.classes.items())
+
+        # cached outputs are reused unless compiled against an interface
+        # that changed since
+        changed = []
+        for input_file_name in to_compile:
+            info = cache.lookup(keys[input_file_name])
+            if info is None or any(interfaces.get(dependency) != interface
+                                   for dependency, interface in
+                                   info["dependencies"].items()):
+                changed.append(input_file_name)
+            else:
+                cache.restore(keys[input_file_name],
+                              get_output_file_name(input_file_name))
+                if report is not None:
+                    report.removed.update(info.get("removed", {}))
+                    report.hoisted.update(info.get("hoisted", {}))
+                    report.common.update(info.get("common", {}))
+                    report.locals.update(info.get("locals", {}))
+        to_compile = changed
+
+    results = dict(zip(to_compile, compile_files(to_compile, jobs, index,
+                                                 optimizations, precedence)))
+    for input_file_name in to_compile:
+        error, info = results[input_file_name]
+        if error is not None:
+            errors[input_file_name] = error
+            continue
+        if report is not None:
+            report.removed.update(info["removed"])
+            report.hoisted.update(info["hoisted"])
+            report.common.update(info["common"])
+            report.locals.update(info["locals"])
+        if cache is not None:
+            # remember what the output was compiled against
+            info["dependencies"] = dict(
+                (dependency, interfaces.get(dependency))
+                for dependency in info["dependencies"])
+            cache.store(keys[input_file_name],
+                        get_output_file_name(input_file_name), info)
+
+    if cache is not None:
+        if whole_program:
+            cache.save_index(index)
+            cache.prune(keys.values())
+        else:
+            # the cache also holds the other files of the directory, they
+            # keep what the last build of it saved
+            saved = cache.load_index()
+            for signature in index.classes.values():
+                saved.add(signature)
+            cache.save_index(saved)
+    if whole_program and not errors and \
+            any(name in engine.WHOLE_PROGRAM for name in optimizations):
+        link(files_to_process, optimizations, report, inline_size)
+    return [errors[input_file_name] for input_file_name in files_to_process
+            if input_file_name in errors]
+
+
+def main(path, jobs=1, use_cache=True, optimizations=(), show_report=False,
+         inline_size=inliner.DEFAULT_MAX_SIZE, precedence=grammar.JACK):
     """
     The program receives a name of a file or a directory, and compiles
      the file, or all the Jack files in this directory.
     For each Xxx.jack file, it creates a Xxx.vm file in the same directory.
 
-    :return:
+    :param path: file or directory
+    :param jobs: number of processes compiling in parallel
+    :param use_cache: reuse outputs of unchanged files, kept in a
+    .jackcache directory next to the sources
+    :param optimizations: names of the optimizations to apply
+    :param show_report: print how many VM instructions every optimization
+    removed from every function, and the size of the program
+    :param inline_size: largest subroutine body inlined, in VM instructions
+    :param precedence: name of the operator precedence table, see
+    JackGrammar.precedences
+    :return: list of error messages
     """
     files_to_process =[]
+    source_dir = path
     if os.path.isfile(path):
         files_to_process = [path]
+        source_dir = os.path.dirname(path)
 
     elif os.path.isdir(path):
-        files_to_process = [os.path.join(path, f) for f in os.listdir(path) if
-                            f.endswith(".jack")]
+        files_to_process = [os.path.join(path, f) for f in
+                            sorted(os.listdir(path)) if f.endswith(".jack")]
 
-    analyze(files_to_process)
+    cache = None
+    # without files there is nothing to cache, and no directory to keep the
+    # cache in if path doesn't exist
+    if use_cache and files_to_process:
+        cache = buildcache.BuildCache(
+            os.path.join(source_dir, buildcache.CACHE_DIR_NAME))
 
+    report = BuildReport()
+    errors = analyze(files_to_process, jobs, cache, optimizations, report,
+                     os.path.isdir(path), inline_size, precedence)
+    for error in errors:
+        sys.stderr.write(error + "\n")
+    if show_report:
+        # passes that move code out of loops or keep values in locals may
+        # add instructions
+        totals = {}
+        for function_name in sorted(report.removed):
+            for name, removed in sorted(report.removed[function_name].items()):
+                print("%s: %d instructions %s by %s" %
+                      (function_name, abs(removed),
+                       "removed" if removed > 0 else "added", name))
+                totals[name] = totals.get(name, 0) + removed
+        for name in sorted(totals):
+            print("total: %d instructions %s by %s" %
+                  (abs(totals[name]),
+                   "removed" if totals[name] >= 0 else "added", name))
+        for function_name in sorted(report.unused):
+            print("%s: unused, %d instructions removed" %
+                  (function_name, report.unused[function_name]))
+        for function_name in sorted(report.hoisted):
+            print("%s: %d values hoisted out of loops" %
+                  (function_name, report.hoisted[function_name]))
+        for function_name in sorted(report.common):
+            print("%s: %d -> %d instructions, common subexpressions reused" %
+                  ((function_name,) + tuple(report.common[function_name])))
+        for function_name in sorted(report.locals):
+            print("%s: %d -> %d locals, %d dead stores removed" %
+                  ((function_name,) + tuple(report.locals[function_name])))
+        for function_name in sorted(report.inlined):
+            print("%s: %d calls inlined" %
+                  (function_name, report.inlined[function_name]))
+        if report.size_before is not None:
+            print("size: %d commands in %d functions -> %d commands in %d "
+                  "functions" % (report.size_before + report.size_after))
+    return errors
 
 
 
-if __name__ == "__main__":
-    main(sys.argv[1])
-
-
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compiles a Jack file, or all Jack files in a directory")
+    parser.add_argument("path", help="Xxx.jack file or directory")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of files compiled in parallel")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="compile every file, don't use the build cache")
+    parser.add_argument("-O", "--optimize", action="store_true",
+                        help="apply all optimizations but " +
+                             ", ".join(engine.OPT_IN))
+    parser.add_argument("--optimizations", default="", metavar="NAMES",
+                        help="optimizations to apply, comma separated: " +
+                             ", ".join(engine.OPTIMIZATIONS))
+    parser.add_argument("--inline-size", type=int,
+                        default=inliner.DEFAULT_MAX_SIZE, metavar="N",
+                        help="largest subroutine inlined, in VM instructions")
+    parser.add_argument("--precedence", default=grammar.JACK,
+                        choices=sorted(grammar.precedences),
+                        help="operator precedence: jack applies operators "
+                             "left to right, conventional does * and / "
+                             "first, then + and -, comparisons, & and |")
+    parser.add_argument("--report", action="store_true",
+                        help="print the instructions every optimization "
+                             "removed per function")
+    arguments = parser.parse_args()
+    optimizations = [name for name in arguments.optimizations.split(",")
+                     if name]
+    for name in optimizations:
+        if name not in engine.OPTIMIZATIONS:
+            parser.error("unknown optimization " + name)
+    if arguments.optimize:
+        optimizations = [name for name in engine.OPTIMIZATIONS
+                         if name not in engine.OPT_IN] + \
+            [name for name in optimizations if name in engine.OPT_IN]
+    if main(arguments.path, arguments.jobs, not arguments.no_cache,
+            optimizations, arguments.report, arguments.inline_size,
+            arguments.precedence):
+        sys.exit(1)
@@ -58,6 +58,10 @@ K_IDENTIFIER = "identifier"
 K_ARG = "argument" ## not a keyword!!!!! - kind
 POINTER = 'pointer'
 CONST = 'constant'
+LOCAL = 'local'
+THIS = 'this'
+THAT = 'that'
+TEMP = 'temp'
 
 
 
@@ -68,43 +72,65 @@ keywords = [K_CLASS ,K_CONSTRUCTOR ,K_FUNCTION ,K_METHOD ,K_FIELD ,K_STATIC
 ,K_RETURN , K_TRUE ,K_FALSE ,K_NULL ,K_THIS ,K_NONE ]
 
 # SYMBOL tokens
-symbols = ['{' , '}' , '(' , ')' , '[' , ']' , '. ' , ',' , ';' , '+' , '-' ,
-          '*' , '/' , '&' , '<' , '>' , '=' , '~',"; ",", "]
+symbols = ['{' , '}' , '(' , ')' , '[' , ']' , '.' , ',' , ';' , '+' , '-' ,
+          '*' , '/' , '&' , '|' , '<' , '>' , '=' , '~']
 
-STRING_RE = r'(\\"[\w\W]*\\" )'
-SYMBOLS_RE = '(\\{|\\}|\\(|\\)|\\[|\\]|\\, |\\;|\\+|\\-|\\' \
-             '*|\\/|\\&|\\,|\\<|\\>|\\=|\\~|\\.)'
 QUOTATION_MARK = "\""
 
 keyword_constant = ["true", "false", "null", "this"]
 
+primitive_types = [K_INT, K_CHAR, K_BOOLEAN]
+
 unaryOp = ["-", '~']
 
 operators = ['+', '-', '*', '/', '&', '|', '<', '>', '=']
 
+# VM command of every operator, * and / are calls to the OS
+op_2_command = {'+': 'add', '-': 'sub', '&': 'and', '|': 'or', '<': 'lt',
+                '>': 'gt', '=': 'eq'}
+op_2_function = {'*': 'Math.multiply', '/': 'Math.divide'}
+unary_op_2_command = {'-': 'neg', '~': 'not'}
+
+# precedence of the binary operators, higher binds tighter, equal ones
+# apply left to right. Jack itself has none: a + b * c is (a + b) * c
+JACK = "jack"
+CONVENTIONAL = "conventional"
+precedences = {
+    JACK: dict((op, 1) for op in operators),
+    # * / before + - before comparisons before & before |
+    CONVENTIONAL: {'*': 6, '/': 6, '+': 5, '-': 5, '<': 4, '>': 4, '=': 3,
+                   '&': 2, '|': 1}}
+
 # tokens type
 tokens_types = ['keyword', 'symbol', 'identifier', 'integerConstant', 'stringConstant']
 
 # REGEX
 
-RE_INT = r'\d+'
-RE_STR = r'"[\w\W]*"'
 RE_ID = r'[a-zA-Z_]+[\w]*'
-RE_NEWLINE = r'/\n'
-RE_WHITESPACES = r'\s' #two or more!
-RE_COMMENT1 = r'//.*[\r\n]+'
-RE_COMMENT2 = r'/\*[\s\S]*?\*/'
-RE_COMMENT3 = r'/\**[\s\S]*?\*/'
-RE_STRING = r'^"[\w\W]*"?'
-
-RE_STRING_COMPILED = re.compile(RE_STRING)
-RE_INT_COMPILED = re.compile(RE_INT)
-RE_STR_COMPILED = re.compile(RE_STR)
 RE_ID_COMPILED = re.compile(RE_ID)
-RE_NEWLINE_COMPILED = re.compile(RE_NEWLINE)
-RE_COMMENT1_COMPILED = re.compile(RE_COMMENT1)
-RE_COMMENT2_COMPILED = re.compile(RE_COMMENT2)
-RE_COMMENT3_COMPILED = re.compile(RE_COMMENT3)
-RE_WHITESPACES_COMPILED = re.compile(RE_WHITESPACES)
-
 
+# single pass lexer: one alternative per token class, tried in this order.
+# whitespace and comments are matched (and dropped) like any other token so
+# the scanner never has to look at the same character twice. a /* that is
+# never closed is matched on its own so it is reported instead of being read
+# as the symbols / and *.
+# the lexer runs over the raw bytes of the file (see JackTokenizer), so the
+# pattern is compiled as a bytes pattern.
+SOURCE_ENCODING = 'latin-1'
+RE_TOKEN = r'''
+    (?P<skip>\s+|//[^\n]*|/\*.*?\*/)
+  | (?P<unterminated>/\*)
+  | (?P<string>"[^"\n]*")
+  | (?P<int>\d+)
+  | (?P<word>[A-Za-z_]\w*)
+  | (?P<symbol>[{}()\[\].,;+\-*/&|<>=~])
+'''
+RE_TOKEN_COMPILED = re.compile(RE_TOKEN.encode(SOURCE_ENCODING),
+                               re.DOTALL | re.VERBOSE)
+
+
+
+# skimming (see ClassIndex) jumps over subroutine bodies: everything up to
+# the next brace that is not inside a comment or a string.
+RE_SKIP_BODY = rb'''(?:[^{}/"]+|//[^\n]*|/\*.*?\*/|"[^"\n]*"|/(?!\*))*'''
+RE_SKIP_BODY_COMPILED = re.compile(RE_SKIP_BODY, re.DOTALL)
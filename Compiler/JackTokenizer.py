@@ -1,8 +1,129 @@
-import os, re, glob
+import mmap
+from array import array
 from xml.sax.saxutils import escape
 from Compiler.JackGrammar import *
 
 
+KEYWORDS = frozenset(keyword.encode(SOURCE_ENCODING) for keyword in keywords)
+GROUP_2_TYPE = {'int': INT_CONST, 'symbol': SYMBOL}
+NO_ID = -1
+
+
+def read_source(input_file):
+    """
+    gets the raw bytes of the input without decoding them. files are
+    memory mapped when possible and read in one call otherwise.
+    :param input_file: open file, or the source itself as bytes / memoryview
+    :return: bytes-like object
+    """
+    if isinstance(input_file, (bytes, bytearray, memoryview)):
+        return input_file
+    try:
+        return mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError):
+        # not a real file (or an empty one, which can't be mapped)
+        pass
+    code = input_file.read()
+    if isinstance(code, str):
+        code = code.encode(SOURCE_ENCODING)
+    return code
+
+
+def line_number(code, pos):
+    """
+    :param code: source code
+    :param pos: offset in it
+    :return: number of the line the offset is in, from 1
+    """
+    return bytes(code[:pos]).count(b"\n") + 1
+
+
+def release_source(code):
+    """
+    unmaps what read_source mapped, instead of leaving it to the garbage
+    collector. the code can't be read afterwards.
+    :param code: what read_source returned
+    :return:
+    """
+    if isinstance(code, mmap.mmap):
+        code.close()
+
+
+class TokenBuffer(object):
+    """
+    Holds the tokens of one file as parallel arrays (struct of arrays)
+    instead of one python object per token:
+
+    kinds  - token type of every token
+    starts - offset of the first character of the token in the code
+    ends   - offset one past its last character (strings without the "")
+    ids    - interned id of keywords, symbols and identifiers, NO_ID for
+             int and string constants, which are sliced out of the code
+             and decoded only when asked for
+    """
+    def __init__(self, code):
+        """
+        Creates an empty buffer over the given code
+        :param code: the source the offsets point into, any bytes-like
+        object (bytes, memoryview, mmap)
+        """
+        self.code = code
+        self.kinds = array('b')
+        self.starts = array('I')
+        self.ends = array('I')
+        self.ids = array('i')
+        self.names = []  # id -> name
+        self.name_ids = {}  # name -> id
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def append(self, kind, start, end):
+        """
+        Adds a token. names are interned, so every distinct keyword, symbol
+        and identifier is stored once no matter how often it appears.
+        :param kind: token type
+        :param start: offset of the token in the code
+        :param end: offset one past the token
+        :return:
+        """
+        if kind == INT_CONST or kind == STRING_CONS:
+            name_id = NO_ID
+        else:
+            name = bytes(self.code[start:end])
+            name_id = self.name_ids.get(name, NO_ID)
+            if name_id == NO_ID:
+                name_id = len(self.names)
+                self.name_ids[name] = name_id
+                self.names.append(str(name, SOURCE_ENCODING))
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.ids.append(name_id)
+
+    def kind(self, index):
+        """
+        :param index: token index
+        :return: type of the token
+        """
+        return self.kinds[index]
+
+    def value(self, index):
+        """
+        :param index: token index
+        :return: the token's value, interned names are looked up and
+        constants are sliced out of the code
+        """
+        name_id = self.ids[index]
+        if name_id != NO_ID:
+            return self.names[name_id]
+        return str(self.code[self.starts[index]:self.ends[index]],
+                   SOURCE_ENCODING)
+
+    def __getitem__(self, index):
+        return self.value(index), self.kinds[index]
+
+
 # handles the compiler's input:
 # allows:
 #     ignoring white space
@@ -15,45 +136,75 @@ class JackTokenizer(object):
         """
         Opens the input file/stream and gets ready
         to tokenize it.
-        :param input_file
+        :param input_file: open file, or the source itself as bytes /
+        memoryview
         """
         self.input_file = input_file #already open!!
-        self.code = self.file_to_str()
+        self.code = self.read_source()
         self.output_file = output_file
-        self.tokens_to_process = self.tokenize_file(self.code)
+        try:
+            self.tokens = self.tokenize_file(self.code)
+        except ValueError:
+            release_source(self.code)
+            raise
+        self.position = 0  # index of the next token in self.tokens
         self.current_token_type = NO_TOKEN
         self.current_value = NO_PHRASE
 
 
 
-    def file_to_str(self):
+    def read_source(self):
+        """
+        gets the raw bytes of the input without decoding them. files are
+        memory mapped when possible and read in one call otherwise.
+        :return: bytes-like object
         """
+        return read_source(self.input_file)
 
+    def close(self):
+        """
+        releases the source, once no more token values are read
         :return:
         """
-        code = ""
-        for line in self.input_file:
-            code+=line
-        return code
+        release_source(self.code)
 
     def has_more_tokens(self):
         """
         checks if we have more tokens in the input
         :return: boolean
         """
-        return self.tokens_to_process != []
+        return self.position < len(self.tokens)
 
-    def get_next(self):
+    def peek(self, k=1):
         """
-
-        :return: value and type of next token
+        looks k tokens ahead without advancing. peek(1) is the token the
+        next advance() will make current.
+        :param k: how far to look, 1 or more
+        :return: value and type of that token, (NO_PHRASE, NO_TOKEN) past
+        the end of the input
         """
-        next_token = self.tokens_to_process[0]
-        next_value, next_type = self.phrase_to_token(next_token)
-        return next_value, next_type
+        index = self.position + k - 1
+        if index < len(self.tokens):
+            return self.tokens.value(index), self.tokens.kind(index)
+        return NO_PHRASE, NO_TOKEN
 
+    def peek_value(self, k=1):
+        """
+        like peek() but only fetches the value
+        :param k: how far to look, 1 or more
+        :return: value of that token, NO_PHRASE past the end of the input
+        """
+        index = self.position + k - 1
+        if index < len(self.tokens):
+            return self.tokens.value(index)
+        return NO_PHRASE
 
+    def get_next(self):
+        """
 
+        :return: value and type of next token
+        """
+        return self.peek()
 
     def advance(self):
         """
@@ -65,15 +216,13 @@ class JackTokenizer(object):
         :return:
         """
 
-        if self.has_more_tokens():
-            current_token = self.tokens_to_process.pop(0)
-            self.current_value, self.current_token_type =\
-                self.phrase_to_token(current_token)
+        if self.position < len(self.tokens):
+            self.current_value = self.tokens.value(self.position)
+            self.current_token_type = self.tokens.kind(self.position)
+            self.position += 1
 
         else:
-            self.current_value, self.current_token_type = NO_TOKEN, NO_PHRASE
-
-        print(self.current_value, self.current_token_type)
+            self.current_value, self.current_token_type = NO_PHRASE, NO_TOKEN
 
 
 
@@ -131,177 +280,68 @@ class JackTokenizer(object):
         """
         return self.current_value
 
-    def find_strings(self,code):
-        """
-
-        :return:
-        """
-        # find strings
-        i = 0
-        start = 0
-        end = code.find("\"")
-        tokenized_lines = []
-        while code[start:end] != "":
-            if not i % 2:
-                tokenized_lines += [code[start:end]]
-                start = end
-                end = code.find("\"", (start + 1))
+    def tokenize(self, code):
+        """
+        scans the code once and yields its tokens already classified.
+        whitespace and comments are skipped on the way.
+        :param code: source code, bytes-like
+        :return: generator of (type, start, end), offsets of strings
+        exclude the ""
+        """
+        pos = 0
+        for match in RE_TOKEN_COMPILED.finditer(code):
+            start = match.start()
+            if start != pos:
+                self.illegal_character(code, pos)
+            pos = match.end()
+            group = match.lastgroup
+            if group == 'skip':
+                continue
+            if group == 'unterminated':
+                self.error(code, start, "Unterminated comment")
+            if group == 'word':
+                if match.group() in KEYWORDS:
+                    yield KEYWORD, start, pos
+                else:
+                    yield IDENTIFIER, start, pos
+            elif group == 'string':
+                yield STRING_CONS, start + 1, pos - 1  # remove "" from string
             else:
-                tokenized_lines += [code[start:(end + 1)]]
-                start = end + 1
-                end = code.find("\"", (start + 1))
-            i += 1
-        # add last line!
-        tokenized_lines += [code[(start):]]
-
-        return tokenized_lines
-
-    def split_lines(self, tokenized_lines):
-        i = 0
-        while i < len(tokenized_lines):
-            if QUOTATION_MARK in tokenized_lines[i]:  # case token is a string
-                tokenized_lines[i] = [tokenized_lines[i].strip()]
-            else:
-                tokenized_lines[i] = tokenized_lines[i].strip()
-                tokenized_lines[i] = tokenized_lines[i].split('\n')
-            i += 1
-        return tokenized_lines
+                yield GROUP_2_TYPE[group], start, pos
 
+        if pos != len(code):
+            self.illegal_character(code, pos)
 
-    def handle_symbols(self,tokenized_lines):
+    def illegal_character(self, code, pos):
         """
-
-        :param tokenized_lines:
-        :return:
+        raises an error for a character no token starts with. a " starts
+        none when the string doesn't end on its line.
+        :param code: source code
+        :param pos: offset of the character
         """
-        new_tokenized = []
-        for part in tokenized_lines:
-            if not re.match(RE_STRING_COMPILED, part.strip()):
-                part = part.replace("\n", "")
-                part = part.replace("\t", "")
-                part = re.split(SYMBOLS_RE, part)
-                new_tokenized += part
-            else:
-                new_tokenized += [part]
-
-        tokenized_lines = new_tokenized
-        return tokenized_lines
+        if code[pos:pos + 1] == b'"':
+            self.error(code, pos, "Unterminated string")
+        self.error(code, pos,
+                   "Illegal character " + repr(bytes(code[pos:pos + 1])))
 
-    def split_tokens(self,tokenized_lines):
+    def error(self, code, pos, message):
         """
-        split tokens
-        :param tokenized_lines:
-        :return:
+        raises an error about the code at the given offset
+        :param code: source code
+        :param pos: offset the error is at
+        :param message: what is wrong, the line number is added to it
         """
-        i = 0
-        while i < len(tokenized_lines):
-            if QUOTATION_MARK in tokenized_lines[i]:  # case token is a string
-                tokenized_lines[i] = [tokenized_lines[i].strip()]
-            else:
-                tokenized_lines[i] = tokenized_lines[i].strip()
-                tokenized_lines[i] = tokenized_lines[i].split(' ')
-            i += 1
-        return tokenized_lines
+        raise ValueError(message + " in line " + str(line_number(code, pos)))
 
-    def tokenize_file(self,file):
+    def tokenize_file(self, code):
         """
-        group the characters of a line into tokens as defined by Jack language
-        syntax
-        :param file:
-        :return: tokenized_lines
+        group the characters of the code into tokens as defined by Jack
+        language syntax
+        :param code:
+        :return: TokenBuffer
         """
-
-        tokenized_lines = self.remove_comments(self.code)
-        tokenized_lines = self.find_strings(tokenized_lines)
-        tokenized_lines = self.split_lines(tokenized_lines)
-        tokenized_lines = [item for sublist in tokenized_lines for
-                           item in sublist]
-        tokenized_lines = self.handle_symbols(tokenized_lines)
-        tokenized_lines = self.split_tokens(tokenized_lines)
-        tokenized_lines = [item for sublist in tokenized_lines for
-                           item in sublist]
-        tokenized_lines = [string for string in tokenized_lines
-                           if len(string) > 0] #remove empty strings
-        return tokenized_lines
-
-    COMMENT_RE = re.compile(r'//[^\n]*\n|/\*(.*?)\*/', re.MULTILINE | re.DOTALL) #TODO : add to grammar
-
-    def remove_comments(self, line):
-        return self.COMMENT_RE.sub('', line)
-
-
-
-    def update_code_by_match(self, match):
-        """
-        updates the code according to regex match
-        :return:
-        """
-        current_code = self.code
-        current_code = re.sub(match,"",current_code)
-        self.code = " ".join(current_code.split())
-
-
-    def phrase_to_token(self, phrase):
-        """
-
-        :param phrase
-        sets token type according to phrase.
-        if phrase is an string removes ""
-
-        """
-        val = phrase
-        type = NO_TOKEN
-
-        if self.is_keyword(phrase):
-            type = KEYWORD
-        elif self.is_string(phrase):
-            type = STRING_CONS
-            val = val[1:-1] # remove "" from string
-        elif self.is_symbol(phrase):
-            type = SYMBOL
-        elif self.is_identifier(phrase):
-            type = IDENTIFIER
-        elif self.is_int(phrase):
-            type = INT_CONST
-        else:
-            type = NO_TOKEN
-        return val, type
-
-    def is_keyword(self, phrase):
-        """
-        :return: boolean
-        """
-        return phrase in keywords
-
-    def is_symbol(self, phrase):
-        """
-
-        :param phrase:
-        :return: boolean
-        """
-        return phrase in symbols
-
-    def is_identifier(self, phrase):
-        """
-
-        :param phrase:
-        :return:
-        """
-        return re.match(RE_ID_COMPILED, phrase)
-
-    def is_int(self, phrase):
-        """
-
-        :param phrase:
-        :return:
-        """
-        return re.match(RE_INT_COMPILED, phrase)
-
-    def is_string(self, phrase):
-        """
-
-        :param phrase:
-        :return:
-        """
-        return re.match(RE_STR_COMPILED, phrase)
-
+        tokens = TokenBuffer(code)
+        append = tokens.append
+        for kind, start, end in self.tokenize(code):
+            append(kind, start, end)
+        return tokens
@@ -0,0 +1,231 @@
+from Compiler.VMCode import Op, Segment
+import Compiler.Values as values
+
+# Liveness of the locals and arguments, a VMwriter pass.
+#
+# A variable is live after an instruction if some path from there reads it
+# before storing to it. This is found over the basic blocks of the function
+# (runs of code between labels and jumps), with one bit per variable: the
+# locals first, then the arguments.
+#
+# A store to a variable that isn't live after it is dead. it is removed
+# together with the code computing the stored value, if that code has no
+# effect (see Values); removing it can make other stores dead, so this
+# repeats until none is left.
+#
+# Locals that are never live at the same time then share a slot, which
+# lowers the number of locals the VM zeroes on every call. The VM zeroes the
+# locals at the start of the function: those live there interfere with each
+# other as if they were all stored to there.
+
+
+class Liveness(values.ValuePass):
+    """
+    Removes the dead stores of a function and packs its locals
+    """
+    def __init__(self, is_getter=None):
+        """
+        :param is_getter: see Values.ValuePass
+        """
+        values.ValuePass.__init__(self, is_getter)
+        # function name -> (locals before, locals after, dead stores
+        # removed), for the functions that changed
+        self.sizes = {}
+
+    def __call__(self, function, code):
+        """
+        removes the dead stores of function and renumbers its locals, in
+        place
+        :param function: VMFunction
+        :param code: VMClass of the function
+        :return:
+        """
+        instructions = function.instructions()
+        n_locals = function.n_locals
+        removed = 0
+        while True:
+            live, entry = find_live(instructions, n_locals)
+            dead = self.dead_stores(instructions, live, n_locals, code.names)
+            if not dead:
+                break
+            output = []
+            position = 0
+            while position < len(instructions):
+                if position in dead:
+                    position = dead[position]
+                else:
+                    output.append(instructions[position])
+                    position += 1
+            instructions = output
+            removed += len(dead)
+
+        slots = pack(instructions, live, entry, n_locals)
+        if not removed and all(local == slot for local, slot in slots.items())\
+                and len(slots) == n_locals:
+            return
+        function.set_instructions(
+            (op, a, slots[b]) if a == Segment.LOCAL and
+            (op == Op.PUSH or op == Op.POP) else (op, a, b)
+            for op, a, b in instructions)
+        function.n_locals = len(set(slots.values()))
+        self.sizes[function.name] = (n_locals, function.n_locals, removed)
+
+    def dead_stores(self, instructions, live, n_locals, names):
+        """
+        :param instructions: list of (op, a, b) of the function
+        :param live: position -> bits of the variables live after it
+        :param n_locals: number of locals of the function
+        :param names: names of the VMClass of the function
+        :return: start -> end of the dead stores that can be removed, with
+        the code computing the value stored
+        """
+        end = len(instructions)
+        computed = {}  # end -> largest Value ending there
+        for value in values.follow(instructions, 0, end, names, self.is_safe,
+                                   lambda uses: True):
+            other = computed.get(value.end)
+            if other is None or value.start < other.start:
+                computed[value.end] = value
+        dead = {}
+        for position, (op, a, b) in enumerate(instructions):
+            bit = variable_bit(a, b, n_locals)
+            if op != Op.POP or bit is None or live[position] >> bit & 1:
+                continue
+            value = computed.get(position)
+            if value is not None and value.start < position and \
+                    values.temps_unused(instructions, value, end):
+                dead[value.start] = position + 1
+        return dead
+
+
+def variable_bit(segment, index, n_locals):
+    """
+    :param segment: Segment
+    :param index:
+    :param n_locals: number of locals of the function
+    :return: the bit of the variable, None if it isn't a local or an
+    argument
+    """
+    if segment == Segment.LOCAL:
+        return index
+    if segment == Segment.ARGUMENT:
+        return n_locals + index
+    return None
+
+
+def find_live(instructions, n_locals):
+    """
+    :param instructions: list of (op, a, b) of a function
+    :param n_locals: number of locals of the function
+    :return: list position -> bits of the variables live after the
+    instruction there, and the bits of those live at the start
+    """
+    if not instructions:
+        return [], 0
+    # basic blocks: [start, end)
+    starts = set([0])
+    for position, (op, a, b) in enumerate(instructions):
+        if op == Op.LABEL:
+            starts.add(position)
+        elif op == Op.GOTO or op == Op.IF_GOTO or op == Op.RETURN:
+            starts.add(position + 1)
+    starts.discard(len(instructions))
+    starts = sorted(starts)
+    ends = starts[1:] + [len(instructions)]
+    block_of_label = dict((instructions[start][1], block)
+                          for block, start in enumerate(starts)
+                          if instructions[start][0] == Op.LABEL)
+
+    successors = []
+    reads = []  # bits read in the block before being stored
+    stores = []  # bits stored in the block
+    for block, (start, end) in enumerate(zip(starts, ends)):
+        op, a, b = instructions[end - 1]
+        following = [block + 1] if block + 1 < len(starts) else []
+        if op == Op.GOTO:
+            following = [block_of_label[a]]
+        elif op == Op.IF_GOTO:
+            following = [block_of_label[a]] + following
+        elif op == Op.RETURN:
+            following = []
+        successors.append(following)
+        read = 0
+        stored = 0
+        for op, a, b in instructions[start:end]:
+            bit = variable_bit(a, b, n_locals)
+            if bit is None:
+                continue
+            if op == Op.PUSH and not stored >> bit & 1:
+                read |= 1 << bit
+            elif op == Op.POP:
+                stored |= 1 << bit
+        reads.append(read)
+        stores.append(stored)
+
+    live_in = [0] * len(starts)
+    live_out = [0] * len(starts)
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(range(len(starts))):
+            out = 0
+            for successor in successors[block]:
+                out |= live_in[successor]
+            live_out[block] = out
+            new_in = reads[block] | (out & ~stores[block])
+            if new_in != live_in[block]:
+                live_in[block] = new_in
+                changed = True
+
+    live = [0] * len(instructions)
+    for block, (start, end) in enumerate(zip(starts, ends)):
+        bits = live_out[block]
+        for position in reversed(range(start, end)):
+            live[position] = bits
+            op, a, b = instructions[position]
+            bit = variable_bit(a, b, n_locals)
+            if bit is None:
+                continue
+            if op == Op.POP:
+                bits &= ~(1 << bit)
+            elif op == Op.PUSH:
+                bits |= 1 << bit
+    return live, live_in[0]
+
+
+def pack(instructions, live, entry, n_locals):
+    """
+    gives the locals that are never live at the same time the same slot
+    :param instructions: list of (op, a, b) of a function
+    :param live: position -> bits of the variables live after it
+    :param entry: bits of the variables live at the start of the function
+    :param n_locals: number of locals of the function
+    :return: dict local -> its slot, for the locals the function uses
+    """
+    locals_mask = (1 << n_locals) - 1
+    used = set()
+    conflicts = [0] * n_locals  # local -> bits of the locals it can't share
+    for position, (op, a, b) in enumerate(instructions):
+        if a != Segment.LOCAL or (op != Op.PUSH and op != Op.POP):
+            continue
+        used.add(b)
+        if op == Op.POP:
+            others = live[position] & locals_mask & ~(1 << b)
+            conflicts[b] |= others
+            for local in range(n_locals):
+                if others >> local & 1:
+                    conflicts[local] |= 1 << b
+    zeroed = entry & locals_mask
+    for local in range(n_locals):
+        if zeroed >> local & 1:
+            conflicts[local] |= zeroed & ~(1 << local)
+
+    slots = {}
+    for local in sorted(used):
+        taken = set(slots[other] for other in slots
+                    if conflicts[local] >> other & 1)
+        slot = 0
+        while slot in taken:
+            slot += 1
+        slots[local] = slot
+    return slots
@@ -0,0 +1,153 @@
+from Compiler.VMCode import Op, Segment
+import Compiler.Values as values
+
+# Loop invariant code motion, a VMwriter pass.
+#
+# A loop is the code from a label to the last jump back to it, a while
+# statement whether its condition is tested at the top or at the bottom
+# (see CompilationEngine.compile_while). The values its code computes are
+# followed (see Values). A value that only reads what the loop doesn't
+# change is the same on every iteration: the code computing it is moved in
+# front of the loop, into a local added to the function, and the loop
+# pushes that local instead. Equal values share the local.
+#
+# What a loop changes is found from its code and kept conservative: any
+# call that isn't known to have no effect may change every field, static
+# and array entry, and so may any write to one of them.
+#
+# The value is computed before the loop even if the loop runs zero times,
+# calls that can stop the program (Math.divide) are never moved.
+
+
+class LoopInvariant(values.ValuePass):
+    """
+    Moves the loop invariant values of a function in front of the loops
+    """
+    def __init__(self, is_getter=None):
+        """
+        :param is_getter: see Values.ValuePass
+        """
+        values.ValuePass.__init__(self, is_getter)
+        self.hoisted = {}  # function name -> values moved out of its loops
+
+    def __call__(self, function, code):
+        """
+        moves the invariant values of the loops of function in front of
+        them, in place
+        :param function: VMFunction
+        :param code: VMClass of the function
+        :return:
+        """
+        instructions = function.instructions()
+        # jumps back to a label make it a loop head, outer loops come first
+        heads = []
+        labels = set()
+        for op, a, b in instructions:
+            if op == Op.LABEL:
+                labels.add(a)
+            elif (op == Op.GOTO or op == Op.IF_GOTO) and a in labels and \
+                    a not in heads:
+                heads.append(a)
+        positions = dict((a, position)
+                         for position, (op, a, b) in enumerate(instructions)
+                         if op == Op.LABEL)
+        heads.sort(key=positions.get)
+
+        hoisted = 0
+        for label in heads:
+            # positions move as code is hoisted
+            loop = find_loop(instructions, label)
+            if loop is None:
+                continue
+            entry, head, back = loop
+            invariant = self.find_invariants(instructions, head, back,
+                                             code.names)
+            if not invariant:
+                continue
+
+            hoisted_code = []
+            locals_used = {}  # code of a value -> local holding it
+            replaced = {}  # start -> (end, local)
+            for value in invariant:
+                computation = tuple(instructions[value.start:value.end])
+                local = locals_used.get(computation)
+                if local is None:
+                    local = function.n_locals
+                    function.n_locals += 1
+                    locals_used[computation] = local
+                    hoisted_code.extend(computation)
+                    hoisted_code.append((Op.POP, Segment.LOCAL, local))
+                replaced[value.start] = (value.end, local)
+            hoisted += len(invariant)
+
+            output = instructions[:entry] + hoisted_code + \
+                instructions[entry:head + 1]
+            position = head + 1
+            while position < len(instructions):
+                if position in replaced:
+                    end, local = replaced[position]
+                    output.append((Op.PUSH, Segment.LOCAL, local))
+                    position = end
+                else:
+                    output.append(instructions[position])
+                    position += 1
+            instructions = output
+
+        if hoisted:
+            function.set_instructions(instructions)
+            self.hoisted[function.name] = hoisted
+
+    def find_invariants(self, instructions, head, back, names):
+        """
+        :param instructions: list of (op, a, b) of the function
+        :param head: position of the label the loop jumps back to
+        :param back: position of the last jump back
+        :param names: names of the VMClass of the function
+        :return: list of the invariant Values of the loop worth moving, not
+        overlapping
+        """
+        changed = set()
+        for instruction in instructions[head + 1:back + 1]:
+            changed |= values.changes(instruction, names, self.is_pure)
+
+        return [value for value in
+                values.follow(instructions, head + 1, back + 1, names,
+                              self.is_safe, changed.isdisjoint)
+                if not value.inner and value.worth_saving() and
+                values.temps_unused(instructions, value, back + 1)]
+
+
+def find_loop(instructions, label):
+    """
+    :param instructions: list of (op, a, b) of a function
+    :param label: id of a label
+    :return: (entry, head, back) of the loop jumping back to label, None if
+    there is none or code outside it jumps in. entry is where the loop is
+    entered: head, or the jump to its condition before it.
+    """
+    head = None
+    back = None
+    for position, (op, a, b) in enumerate(instructions):
+        if a != label:
+            continue
+        if op == Op.LABEL:
+            head = position
+        elif (op == Op.GOTO or op == Op.IF_GOTO) and head is not None:
+            back = position
+    if back is None:
+        return None
+
+    labels = set(a for op, a, b in instructions[head:back + 1]
+                 if op == Op.LABEL)
+    entry = head
+    if head > 0:
+        op, a, b = instructions[head - 1]
+        if op == Op.GOTO and a in labels:
+            entry = head - 1
+        elif op == Op.GOTO or op == Op.RETURN:
+            return None
+    for position, (op, a, b) in enumerate(instructions):
+        if (op == Op.GOTO or op == Op.IF_GOTO) and a in labels and \
+                not head <= position <= back and position != entry:
+            return None
+    return entry, head, back
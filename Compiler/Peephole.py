@@ -0,0 +1,142 @@
+from Compiler.VMCode import Op, Segment
+
+# Peephole optimizer, run as a VMwriter pass over every function.
+# Instructions are copied one by one to the output; after each copy the
+# rules whose pattern ends with the opcode just copied are tried on the end
+# of the output. a rule that matches replaces those instructions, and the
+# replacement is looked at again, so rewrites cascade
+# (push constant 0 / not / not / if-goto L  ->  push constant 0 / if-goto L
+# ->  nothing).
+#
+# A rule is (name, opcodes of the pattern, rewrite). rewrite gets the
+# matched instructions as (op, a, b) tuples and returns the instructions
+# replacing them, or None if the operands don't fit.
+
+
+def push_pop(window):
+    # push x / pop x: the value is stored where it came from
+    (_, segment, index), (_, pop_segment, pop_index) = window
+    if segment == pop_segment and index == pop_index:
+        return []
+    return None
+
+
+def cancel(window):
+    # not / not, neg / neg
+    return []
+
+
+def zero_identity(window):
+    # push constant 0 / add, sub or or
+    (_, segment, index), _ = window
+    if segment == Segment.CONSTANT and index == 0:
+        return []
+    return None
+
+
+def true_identity(window):
+    # push constant 0 / not / and: x & true is x
+    (_, segment, index), _, _ = window
+    if segment == Segment.CONSTANT and index == 0:
+        return []
+    return None
+
+
+def constant_branch(window):
+    # push constant k / if-goto L: taken unless k is 0
+    (_, segment, index), (_, label, _) = window
+    if segment != Segment.CONSTANT:
+        return None
+    if index == 0:
+        return []
+    return [(Op.GOTO, label, 0)]
+
+
+def true_branch(window):
+    # push constant 0 / not / if-goto L: always taken
+    (_, segment, index), _, (_, label, _) = window
+    if segment == Segment.CONSTANT and index == 0:
+        return [(Op.GOTO, label, 0)]
+    return None
+
+
+def inverted_branch(window):
+    # x / not / if-goto A / goto B / label A  ->  x / if-goto B / label A
+    # when x is a comparison: only true (-1) and false (0) invert like
+    # that, if-goto takes any other nonzero value for true as well
+    _, _, (_, target, _), (_, other, _), (_, label, _) = window
+    if target == label and other != label:
+        return [window[0], (Op.IF_GOTO, other, 0), window[4]]
+    return None
+
+
+def goto_next(window):
+    # goto L / label L
+    (_, target, _), (_, label, _) = window
+    if target == label:
+        return [window[1]]
+    return None
+
+
+RULES = [
+    ("push-pop", (Op.PUSH, Op.POP), push_pop),
+    ("not-not", (Op.NOT, Op.NOT), cancel),
+    ("neg-neg", (Op.NEG, Op.NEG), cancel),
+    ("add-zero", (Op.PUSH, Op.ADD), zero_identity),
+    ("sub-zero", (Op.PUSH, Op.SUB), zero_identity),
+    ("or-zero", (Op.PUSH, Op.OR), zero_identity),
+    ("and-true", (Op.PUSH, Op.NOT, Op.AND), true_identity),
+    ("constant-branch", (Op.PUSH, Op.IF_GOTO), constant_branch),
+    ("true-branch", (Op.PUSH, Op.NOT, Op.IF_GOTO), true_branch),
+    ("inverted-branch", (Op.EQ, Op.NOT, Op.IF_GOTO, Op.GOTO, Op.LABEL),
+     inverted_branch),
+    ("inverted-branch", (Op.GT, Op.NOT, Op.IF_GOTO, Op.GOTO, Op.LABEL),
+     inverted_branch),
+    ("inverted-branch", (Op.LT, Op.NOT, Op.IF_GOTO, Op.GOTO, Op.LABEL),
+     inverted_branch),
+    ("goto-next", (Op.GOTO, Op.LABEL), goto_next),
+]
+
+
+class Peephole(object):
+    """
+    VMwriter pass applying a table of rewrite rules over a sliding window
+    """
+    def __init__(self, rules=None):
+        """
+        :param rules: list of (name, pattern, rewrite), RULES if None
+        """
+        self.rules = {}  # last opcode of the pattern -> rules
+        for rule in (RULES if rules is None else rules):
+            self.rules.setdefault(rule[1][-1], []).append(rule)
+
+    def __call__(self, function, code):
+        """
+        optimizes the instructions of function in place
+        :param function: VMFunction
+        :param code: VMClass of the function
+        :return:
+        """
+        rules = self.rules
+        output = []
+        pending = function.instructions()
+        pending.reverse()
+        while pending:
+            instruction = pending.pop()
+            output.append(instruction)
+            for name, pattern, rewrite in rules.get(instruction[0], ()):
+                size = len(pattern)
+                if len(output) < size:
+                    continue
+                window = output[-size:]
+                if any(window[i][0] != pattern[i] for i in range(size - 1)):
+                    continue
+                replacement = rewrite(window)
+                if replacement is not None:
+                    del output[-size:]
+                    # the replacement goes through the rules again
+                    pending.extend(reversed(replacement))
+                    break
+
+        if len(output) != len(function):
+            function.set_instructions(output)
@@ -0,0 +1,120 @@
+from Compiler.VMCode import Op, Segment
+import Compiler.Expression as expression
+
+# Multiplication and division by constants without the OS. Math.multiply
+# and Math.divide loop over the bits of their operands on the target, a
+# constant operand lets the compiler write that loop out for the bits that
+# are set.
+#
+# The VM has no dup and no shifts:
+#   x * c   the operand is kept in temp 0 and doubled by adding it to itself
+#           (Horner over the bits of c, the product is built in temp 1).
+#   x / 2^k only when x is known not to be negative: every bit i >= k that
+#           can be set in x is tested and moved down to bit i - k by
+#           masking the -1 a comparison gives.
+# Both use temp 0 and 1, which hold nothing across expressions.
+
+# longest code written instead of a call, the OS call runs hundreds of
+# instructions
+MAX_MULTIPLY_CODE = 24
+MAX_DIVIDE_CODE = 64
+
+PUSH_T0 = (Op.PUSH, Segment.TEMP, 0)
+POP_T0 = (Op.POP, Segment.TEMP, 0)
+PUSH_T1 = (Op.PUSH, Segment.TEMP, 1)
+POP_T1 = (Op.POP, Segment.TEMP, 1)
+ADD = (Op.ADD, 0, 0)
+
+
+def push_constant(value):
+    return (Op.PUSH, Segment.CONSTANT, value)
+
+
+def multiply_code(factor):
+    """
+    :param factor: constant the value on the stack is multiplied by
+    :return: instructions replacing push factor / call Math.multiply 2, None
+    if they would be too long
+    """
+    if factor == 0:
+        return [POP_T0, push_constant(0)]
+    if factor == expression.MIN_INT:
+        return None
+    negative = factor < 0
+    factor = abs(factor)
+    code = []
+    if factor != 1:
+        bits = bin(factor)[3:]  # after the leading 1, which is x itself
+        code.append(POP_T0)
+        for count, bit in enumerate(bits):
+            # acc = 2 * acc (+ x), acc starts as x
+            if count:
+                code.extend([POP_T1, PUSH_T1, PUSH_T1, ADD])
+            else:
+                code.extend([PUSH_T0, PUSH_T0, ADD])
+            if bit == "1":
+                code.extend([PUSH_T0, ADD])
+    if negative:
+        code.append((Op.NEG, 0, 0))
+    if len(code) > MAX_MULTIPLY_CODE:
+        return None
+    return code
+
+
+def divide_code(divisor, bound):
+    """
+    :param divisor: constant the value on the stack is divided by
+    :param bound: the value on the stack is known to be between 0 and bound
+    :return: instructions replacing push divisor / call Math.divide 2, None
+    if divisor isn't a power of two or the code would be too long
+    """
+    if divisor <= 0 or divisor & (divisor - 1):
+        return None
+    shift = divisor.bit_length() - 1
+    if shift == 0:
+        return []
+    code = [POP_T0]
+    bits = range(shift, bound.bit_length())
+    if not bits:
+        code.append(push_constant(0))
+    for count, bit in enumerate(bits):
+        # bit of x set ? -1 : 0, masked to the bit of the quotient
+        code.extend([PUSH_T0, push_constant(1 << bit), (Op.AND, 0, 0),
+                     push_constant(0), (Op.GT, 0, 0),
+                     push_constant(1 << (bit - shift)), (Op.AND, 0, 0)])
+        if count:
+            code.append(ADD)
+    if len(code) > MAX_DIVIDE_CODE:
+        return None
+    return code
+
+
+def upper_bound(node):
+    """
+    :param node: expression.Node
+    :return: the largest value node can have if it is known never to be
+    negative, None otherwise
+    """
+    if node.kind == expression.CONSTANT:
+        return node.value if node.value >= 0 else None
+    if node.kind != expression.BINARY:
+        return None
+    left = upper_bound(node.left)
+    right = upper_bound(node.right)
+    op = node.op
+    if op == "&":
+        # masking with a non negative value clears the sign
+        if left is None or right is None:
+            return left if right is None else right
+        return min(left, right)
+    if left is None or right is None:
+        return None
+    if op == "|":
+        return (1 << max(left, right).bit_length()) - 1
+    if op == "+" and left + right <= expression.MAX_INT:
+        return left + right
+    if op == "*" and left * right <= expression.MAX_INT:
+        return left * right
+    if op == "/" and node.right.kind == expression.CONSTANT and right > 0:
+        return left // right
+    return None
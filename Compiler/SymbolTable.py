@@ -18,12 +18,19 @@ class Kind(Enum):
     """
     enum represent kind of identifier may appear in the symbol table
     """
+    static = Compiler.JackGrammar.static
+    field = Compiler.JackGrammar.field
+    arg = Compiler.JackGrammar.arg
+    var = Compiler.JackGrammar.var
 
     def get_seg(self):
+        """
+        :return: the VM segment variables of this kind live in
+        """
         if self is Kind.var:
-            return K_VAR
+            return LOCAL
         elif self is Kind.field:
-            return K_FIELD
+            return THIS
         elif self is Kind.arg:
             return K_ARG
         elif self is Kind.static:
@@ -33,7 +40,7 @@ class Kind(Enum):
 C_TYPE = 0
 C_KIND = 1
 C_INDEX = 2
-NO_TYPE, NO_KIND, NO_INDEX = -1
+NO_TYPE, NO_KIND, NO_INDEX = -1, -1, -1
 
 
 class SymbolTable(object):
@@ -83,6 +90,7 @@ class SymbolTable(object):
         :param kind:(STATIC,FIELD, ARG, or VAR)
         :return:
         """
+        kind = Kind(kind)
         if kind == Kind.static or kind == Kind.field:
             self.class_table[name] = (type, kind, self.counter[kind])
         else:
@@ -98,7 +106,7 @@ class SymbolTable(object):
         :param kind:STATIC,FIELD, ARG, or VAR
         :return: int
         """
-        return self.counter[kind]
+        return self.counter[Kind(kind)]
 
 
     def kindOf(self, name):
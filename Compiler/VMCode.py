@@ -0,0 +1,269 @@
+from enum import IntEnum
+from array import array
+
+# In memory representation of the VM code of a class. Every function keeps
+# its instructions in three parallel arrays: the opcode and two integer
+# operands.
+#
+#   push / pop              a = segment, b = index
+#   label / goto / if-goto  a = id of the label name
+#   call                    a = id of the function name, b = number of args
+#   arithmetic / return     unused (0)
+#
+# Names are interned in the VMClass the function belongs to. Passes work on
+# the arrays, serialize() turns a class into .vm text.
+
+
+class Op(IntEnum):
+    """
+    VM commands
+    """
+    PUSH = 0
+    POP = 1
+    ADD = 2
+    SUB = 3
+    NEG = 4
+    EQ = 5
+    GT = 6
+    LT = 7
+    AND = 8
+    OR = 9
+    NOT = 10
+    LABEL = 11
+    GOTO = 12
+    IF_GOTO = 13
+    CALL = 14
+    RETURN = 15
+
+
+class Segment(IntEnum):
+    """
+    VM memory segments
+    """
+    CONSTANT = 0
+    ARGUMENT = 1
+    LOCAL = 2
+    STATIC = 3
+    THIS = 4
+    THAT = 5
+    POINTER = 6
+    TEMP = 7
+
+
+OP_NAMES = ["push", "pop", "add", "sub", "neg", "eq", "gt", "lt", "and", "or",
+            "not", "label", "goto", "if-goto", "call", "return"]
+SEGMENT_NAMES = ["constant", "argument", "local", "static", "this", "that",
+                 "pointer", "temp"]
+
+name_2_op = dict((name, Op(op)) for op, name in enumerate(OP_NAMES))
+name_2_segment = dict((name, Segment(segment))
+                      for segment, name in enumerate(SEGMENT_NAMES))
+
+ARITHMETIC = frozenset([Op.ADD, Op.SUB, Op.NEG, Op.EQ, Op.GT, Op.LT, Op.AND,
+                        Op.OR, Op.NOT])
+# net number of values an instruction pushes (calls: 1 - number of args)
+STACK_EFFECT = {Op.PUSH: 1, Op.POP: -1, Op.ADD: -1, Op.SUB: -1, Op.NEG: 0,
+                Op.EQ: -1, Op.GT: -1, Op.LT: -1, Op.AND: -1, Op.OR: -1,
+                Op.NOT: 0, Op.LABEL: 0, Op.GOTO: 0, Op.IF_GOTO: -1,
+                Op.RETURN: -1}
+
+
+class VMFunction(object):
+    """
+    The instructions of one VM function
+    """
+    def __init__(self, name, n_locals):
+        """
+        :param name: Class.function
+        :param n_locals: number of local variables
+        """
+        self.name = name
+        self.n_locals = n_locals
+        self.ops = array('B')
+        self.a = array('i')
+        self.b = array('i')
+
+    def __len__(self):
+        return len(self.ops)
+
+    def append(self, op, a=0, b=0):
+        """
+        adds an instruction at the end of the function
+        :param op: Op
+        :param a: first operand
+        :param b: second operand
+        :return:
+        """
+        self.ops.append(op)
+        self.a.append(a)
+        self.b.append(b)
+
+    def insert(self, position, instructions):
+        """
+        inserts instructions before the one at position
+        :param position: index in the function
+        :param instructions: list of (op, a, b)
+        :return:
+        """
+        for op, a, b in reversed(instructions):
+            self.ops.insert(position, op)
+            self.a.insert(position, a)
+            self.b.insert(position, b)
+
+    def truncate(self, length):
+        """
+        removes the instructions from position length on
+        :param length: number of instructions kept
+        :return:
+        """
+        self.delete(length, len(self.ops))
+
+    def delete(self, start, end):
+        """
+        removes the instructions from position start to end (excluded)
+        :param start:
+        :param end:
+        :return:
+        """
+        del self.ops[start:end]
+        del self.a[start:end]
+        del self.b[start:end]
+
+    def cut(self, start):
+        """
+        removes the instructions from position start on
+        :param start:
+        :return: the instructions removed, as a list of (op, a, b)
+        """
+        instructions = list(zip(self.ops[start:], self.a[start:],
+                                self.b[start:]))
+        self.truncate(start)
+        return instructions
+
+    def instructions(self, start=0, end=None):
+        """
+        :param start: position of the first instruction
+        :param end: position after the last one, the end of the function if
+        None
+        :return: list of (op, a, b)
+        """
+        if start == 0 and end is None:
+            return list(zip(self.ops, self.a, self.b))
+        return list(zip(self.ops[start:end], self.a[start:end],
+                        self.b[start:end]))
+
+    def set_instructions(self, instructions):
+        """
+        replaces the body of the function
+        :param instructions: iterable of (op, a, b)
+        :return:
+        """
+        self.ops = array('B')
+        self.a = array('i')
+        self.b = array('i')
+        for op, a, b in instructions:
+            self.ops.append(op)
+            self.a.append(a)
+            self.b.append(b)
+
+
+class VMClass(object):
+    """
+    The functions of one .vm file and the names they use
+    """
+    def __init__(self):
+        self.functions = []
+        self.names = []  # id -> label / function name
+        self.name_ids = {}  # name -> id
+
+    def intern(self, name):
+        """
+        :param name: label or function name
+        :return: its id
+        """
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = len(self.names)
+            self.name_ids[name] = name_id
+            self.names.append(name)
+        return name_id
+
+    def new_function(self, name, n_locals):
+        """
+        starts a new function at the end of the class
+        :param name: Class.function
+        :param n_locals: number of local variables
+        :return: VMFunction
+        """
+        function = VMFunction(name, n_locals)
+        self.functions.append(function)
+        return function
+
+
+def parse(text):
+    """
+    reads .vm text, as written by serialize, back into a VMClass
+    :param text: str
+    :return: VMClass
+    """
+    vm_class = VMClass()
+    function = None
+    for line in text.splitlines():
+        words = line.split()
+        if not words or words[0].startswith("//"):
+            continue
+        command = words[0]
+        if command == "function":
+            function = vm_class.new_function(words[1], int(words[2]))
+            continue
+        op = name_2_op.get(command)
+        if op is None or function is None:
+            raise ValueError("Unexpected VM command " + line)
+        if op == Op.PUSH or op == Op.POP:
+            function.append(op, name_2_segment[words[1]], int(words[2]))
+        elif op == Op.CALL:
+            function.append(op, vm_class.intern(words[1]), int(words[2]))
+        elif op == Op.LABEL or op == Op.GOTO or op == Op.IF_GOTO:
+            function.append(op, vm_class.intern(words[1]))
+        else:
+            function.append(op)
+    return vm_class
+
+
+def size(vm_class):
+    """
+    :param vm_class: VMClass
+    :return: number of VM commands of the class, function declarations
+    included
+    """
+    return sum(len(function) + 1 for function in vm_class.functions)
+
+
+def serialize(vm_class, functions=None):
+    """
+    :param vm_class: VMClass
+    :param functions: the functions to write, all functions of the class if
+    None
+    :return: the .vm text of the functions
+    """
+    names = vm_class.names
+    lines = []
+    append = lines.append
+    formatted = {}
+    for function in (vm_class.functions if functions is None else functions):
+        append("function %s %d\n" % (function.name, function.n_locals))
+        for instruction in zip(function.ops, function.a, function.b):
+            line = formatted.get(instruction)
+            if line is None:
+                op, a, b = instruction
+                if op == Op.PUSH or op == Op.POP:
+                    line = "%s %s %d\n" % (OP_NAMES[op], SEGMENT_NAMES[a], b)
+                elif op == Op.CALL:
+                    line = "call %s %d\n" % (names[a], b)
+                elif op == Op.LABEL or op == Op.GOTO or op == Op.IF_GOTO:
+                    line = "%s %s\n" % (OP_NAMES[op], names[a])
+                else:
+                    line = OP_NAMES[op] + "\n"
+                formatted[instruction] = line
+            append(line)
+    return "".join(lines)
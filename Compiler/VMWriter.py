@@ -1,17 +1,60 @@
+import Compiler.VMCode as vmcode
+from Compiler.VMCode import Op
+
 # This class writes VM commands into a file. It encapsulates the VM
 # command syntax.
+# Commands are not written as text right away, they are recorded in a
+# VMClass (see VMCode), one instruction list per function. When the writer
+# is flushed or closed the passes given to it run over every recorded
+# function, then the functions are serialized and written to the file in
+# one call. if a buffer size is given, the recorded functions are also
+# written out when they hold that many commands at the start of a function.
+
 
 class VMwriter(object):
     """
     Emits VM commands into a file
     """
-    def __init__(self, output_file):
+    def __init__(self, output_file, buffer_size=None, passes=()):
         """
         Creates a new file and prepares it for writing VM commands
         :param output_file:
+        :param buffer_size: number of commands kept before they are written,
+        None to write only on flush() / close()
+        :param passes: list of (name, pass), every pass is a function
+        called as pass(function, code) on every VMFunction before it is
+        written, in order
         """
         self.output_file = output_file #already opened in main
-
+        self.buffer_size = buffer_size
+        self.passes = passes
+        self.code = vmcode.VMClass()
+        self.function = None  # VMFunction written to
+        self.recorded = 0  # number of commands not written yet
+        # function name -> pass name -> commands the pass removed from it
+        self.removed = {}
+
+    def flush(self):
+        """
+        runs the passes over the recorded functions and writes them to the
+        file
+        :return:
+        """
+        functions = self.code.functions
+        if functions:
+            for function in functions:
+                for name, vm_pass in self.passes:
+                    size = len(function)
+                    vm_pass(function, self.code)
+                    if len(function) != size:
+                        removed = self.removed.setdefault(function.name, {})
+                        removed[name] = \
+                            removed.get(name, 0) + size - len(function)
+            self.output_file.write(vmcode.serialize(self.code))
+            # names stay interned, ids of functions still being written
+            # must not change
+            del functions[:]
+        self.recorded = 0
 
     def writePush(self, segment, index):
         """
@@ -20,8 +63,8 @@ class VMwriter(object):
         :param index:int
         :return:
         """
-
-        self.output_file.write("push "+segment+" "+str(index)+"\n" )
+        self.function.append(Op.PUSH, vmcode.name_2_segment[segment],
+                             int(index))
 
     def writePop(self, segment, index):
         """
@@ -30,7 +73,8 @@ class VMwriter(object):
         :param index:int
         :return:
         """
-        self.output_file.write("pop "+segment+" "+str(index)+"\n" )
+        self.function.append(Op.POP, vmcode.name_2_segment[segment],
+                             int(index))
 
     def WriteArithmetic(self, command):
         """
@@ -38,7 +82,7 @@ class VMwriter(object):
         :param command:ADD, SUB, NEG, EQ, GT, LT, AND, OR, NOT
         :return:
         """
-        self.output_file.write(command + "\n")
+        self.function.append(vmcode.name_2_op[command])
 
     def WriteLabel(self, label):
         """
@@ -47,7 +91,7 @@ class VMwriter(object):
         :param label: string
         :return:
         """
-        self.output_file.write("label " + label + "\n")
+        self.function.append(Op.LABEL, self.code.intern(label))
 
 
     def WriteGoto(self, label):
@@ -56,7 +100,7 @@ class VMwriter(object):
         :param label:
         :return:
         """
-        self.output_file.write("goto " + label + "\n")
+        self.function.append(Op.GOTO, self.code.intern(label))
 
     def WriteIf(self, label):
         """
@@ -64,7 +108,7 @@ class VMwriter(object):
         :param label:
         :return:
         """
-        self.output_file.write("if-goto " + label + "\n")
+        self.function.append(Op.IF_GOTO, self.code.intern(label))
 
     def writeCall(self, name, n):
         """
@@ -74,28 +118,33 @@ class VMwriter(object):
         :param n: num of args
         :return:
         """
-        self.output_file.write("call " + name + " " + str(n) + "\n")
+        self.function.append(Op.CALL, self.code.intern(name), n)
 
     def writeFunction(self, name, n):
         """
-        Writes a VM function command
+        Starts a new VM function, the commands written next belong to it
         :param name:
         :param n: num of locals
         :return:
         """
-        self.output_file.write("function " + name + " " + str(n) + "\n")
+        if self.function is not None:
+            self.recorded += len(self.function)
+            if self.buffer_size is not None and \
+                    self.recorded >= self.buffer_size:
+                self.flush()
+        self.function = self.code.new_function(name, n)
 
     def writeReturn(self):
         """
         Writes a VM return command
         :return:
         """
-        self.output_file.write("return" + "\n")
+        self.function.append(Op.RETURN)
 
     def close(self):
         """
-        Closes the output file
+        Writes what is left in the buffer and closes the output file
         :return:
         """
+        self.flush()
         self.output_file.close()
-
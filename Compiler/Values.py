@@ -0,0 +1,309 @@
+from Compiler.VMCode import Op, Segment
+
+# The values straight VM code computes, followed on a model of the stack,
+# for the passes that move or reuse them (LoopInvariant,
+# CommonSubexpressions).
+#
+# A Value is the code computing one value on the stack: a contiguous run
+# of instructions that leaves exactly that value and has no effect but on
+# temp and pointer 1. Such code can be replaced by a push of a local
+# holding the value, as long as what it reads, its uses, didn't change.
+#   - locals, arguments: (segment, index)
+#   - this: MEMORY and (pointer, 0)
+#   - statics, array entries, getters: MEMORY
+#
+# temp is only used inside a statement: a value may set and read temps, as
+# multiplications by constants do. it only counts as having no effect if
+# it reads no temp it doesn't set itself, and if no code after it reads the
+# temps it set (see temps_unused). an array entry read sets pointer 1 the
+# same way: the code after it may go on reading that (see
+# CompilationEngine.that_offset).
+
+MEMORY = "memory"  # fields, statics and array entries
+POINTER_THIS = (Segment.POINTER, 0)
+POINTER_THAT = (Segment.POINTER, 1)
+
+# OS functions that only compute their result from their arguments
+PURE_CALLS = frozenset(["Math.multiply", "Math.divide", "Math.abs",
+                        "Math.min", "Math.max", "Math.sqrt"])
+# those of them that stop the program on some arguments
+FAILING_CALLS = frozenset(["Math.divide", "Math.sqrt"])
+
+BINARY = frozenset([Op.ADD, Op.SUB, Op.EQ, Op.GT, Op.LT, Op.AND, Op.OR])
+UNARY = frozenset([Op.NEG, Op.NOT])
+
+
+class Value(object):
+    """
+    A value on the stack and the code computing it
+    """
+    __slots__ = ("start", "end", "known", "constant", "operations", "uses",
+                 "sets", "reads", "inner")
+
+    def __init__(self, start, end, known, constant=False, operations=0,
+                 uses=frozenset(), sets=frozenset(), reads=frozenset()):
+        """
+        :param start: position of the first instruction computing it
+        :param end: position after the last one
+        :param known: True if the code has no effect and only reads what
+        the pass accepts
+        :param constant: True if it is computed from constants only
+        :param operations: number of instructions computing it that aren't
+        pushes
+        :param uses: what it reads, see the top of the file
+        :param sets: temps its code sets, and POINTER_THAT if it sets
+        pointer 1
+        :param reads: temps its code reads before setting them
+        """
+        self.start = start
+        self.end = end
+        self.known = known
+        self.constant = constant
+        self.operations = operations
+        self.uses = uses
+        self.sets = sets
+        self.reads = reads
+        self.inner = False  # True if it is part of a larger known value
+
+    def worth_saving(self):
+        """
+        :return: True if pushing a local is cheaper than the code
+        """
+        return self.known and self.operations > 0 and \
+            not self.constant and not self.reads
+
+
+def combine(operands, end, operations=1, uses=frozenset()):
+    """
+    :param operands: Values the instruction at end - 1 takes, in stack
+    order, all known
+    :param end: position after the instruction
+    :param operations: number of instructions the combination adds
+    :param uses: what the instruction reads itself
+    :return: Value of the result, None if the code of the operands isn't
+    contiguous
+    """
+    for left, right in zip(operands, operands[1:]):
+        if left.end != right.start:
+            return None
+    sets = set()
+    reads = set()
+    for operand in operands:
+        reads |= operand.reads - sets
+        sets |= operand.sets
+        uses = uses | operand.uses
+        operand.inner = True
+    start = operands[0].start if operands else end - operations
+    return Value(start, end, True,
+                 all(operand.constant for operand in operands),
+                 sum(operand.operations for operand in operands) +
+                 operations, uses, frozenset(sets), frozenset(reads))
+
+
+def reads(segment, index):
+    """
+    :param segment: Segment pushed from
+    :param index:
+    :return: uses of the push, None if it can't be part of a Value
+    """
+    if segment == Segment.CONSTANT:
+        return frozenset()
+    if segment == Segment.LOCAL or segment == Segment.ARGUMENT:
+        return frozenset([(segment, index)])
+    if segment == Segment.STATIC:
+        return frozenset([MEMORY])
+    if segment == Segment.THIS:
+        return frozenset([MEMORY, POINTER_THIS])
+    if segment == Segment.POINTER and index == 0:
+        return frozenset([POINTER_THIS])
+    return None
+
+
+def pure_call(name, is_getter=None):
+    """
+    :param name: function called
+    :param is_getter: function name -> True if the function only returns a
+    field, a static, an argument or a constant, None if no function is
+    :return: None if a call to it may have an effect, otherwise what its
+    result reads besides the arguments
+    """
+    if name in PURE_CALLS:
+        return frozenset()
+    if is_getter is not None and is_getter(name):
+        return frozenset([MEMORY])
+    return None
+
+
+class ValuePass(object):
+    """
+    A VMwriter pass over the Values of a function, knowing which calls
+    have no effect
+    """
+    def __init__(self, is_getter=None):
+        """
+        :param is_getter: function name -> True if the function only
+        returns a variable or a constant, None if no function is
+        """
+        self.is_getter = is_getter
+
+    def is_pure(self, name):
+        """
+        :param name: function called
+        :return: None if a call to it may have an effect, otherwise what its
+        result reads besides the arguments
+        """
+        return pure_call(name, self.is_getter)
+
+    def is_safe(self, name):
+        """
+        :param name: function called
+        :return: like is_pure, but None as well for calls that can stop the
+        program, that code may only skip or run earlier without them
+        """
+        if name in FAILING_CALLS:
+            return None
+        return self.is_pure(name)
+
+
+def changes(instruction, names, is_pure):
+    """
+    :param instruction: (op, a, b)
+    :param names: names of the VMClass of the instruction
+    :param is_pure: function name -> None if a call to it may have an
+    effect
+    :return: the uses the instruction may change
+    """
+    op, a, b = instruction
+    if op == Op.POP:
+        if a == Segment.LOCAL or a == Segment.ARGUMENT:
+            return frozenset([(a, b)])
+        if a == Segment.STATIC or a == Segment.THIS or a == Segment.THAT:
+            return frozenset([MEMORY])
+        if a == Segment.POINTER and b == 0:
+            return frozenset([POINTER_THIS])
+    elif op == Op.CALL and is_pure(names[a]) is None:
+        return frozenset([MEMORY])
+    return frozenset()
+
+
+def follow(instructions, start, end, names, is_pure, is_known):
+    """
+    follows the values instructions[start:end] compute. nothing is kept
+    across labels and jumps.
+    :param instructions: list of (op, a, b)
+    :param start: position to start at
+    :param end: position to stop at
+    :param names: names of the VMClass of the instructions
+    :param is_pure: function name -> None if a call to it may have an
+    effect, otherwise the uses of its result besides its arguments
+    :param is_known: uses -> True if a value reading them is accepted
+    :return: list of the known Values, in the order their code ends
+    """
+    values = []
+    stack = []
+    temps = set()  # temps holding a known value
+    # the known value just popped to a temp: (Value, Value of its code and
+    # the pop)
+    stored = None
+
+    def pop_operands(count):
+        first = max(len(stack) - count, 0)
+        operands = stack[first:]
+        del stack[first:]
+        if len(operands) < count:
+            # pushed before start
+            operands.insert(0, Value(0, 0, False))
+        return operands
+
+    position = start
+    while position < end:
+        op, a, b = instructions[position]
+        value = None
+        if stored is not None and \
+                (op != Op.PUSH or stored[1].end != position):
+            stored = None
+
+        if op == Op.PUSH:
+            if a == Segment.TEMP:
+                value = Value(position, position + 1, b in temps,
+                              reads=frozenset([b]))
+            else:
+                uses = reads(a, b)
+                value = Value(position, position + 1,
+                              uses is not None and is_known(uses),
+                              a == Segment.CONSTANT, 0, uses or frozenset())
+            if stored is not None and value.known:
+                # the code of the value stored goes on with this one
+                stored[0].inner = True
+                value = combine([stored[1], value], position + 1, 0)
+            stored = None
+        elif op == Op.POP:
+            operand = pop_operands(1)[0]
+            if a == Segment.POINTER and b == 1 and operand.known and \
+                    position + 1 < end and \
+                    instructions[position + 1][:2] == (Op.PUSH,
+                                                       Segment.THAT) and \
+                    is_known(frozenset([MEMORY])):
+                # an array entry read
+                value = combine([operand], position + 2, 2,
+                                frozenset([MEMORY]))
+                value.sets = value.sets | frozenset([POINTER_THAT])
+                position += 1
+            elif a == Segment.TEMP and operand.known:
+                temps.add(b)
+                stored = (operand, Value(
+                    operand.start, position + 1, True, operand.constant,
+                    operand.operations + 1, operand.uses,
+                    operand.sets | frozenset([b]), operand.reads))
+            elif a == Segment.TEMP:
+                temps.discard(b)
+        elif op in BINARY or op in UNARY or op == Op.CALL:
+            uses = frozenset()
+            if op == Op.CALL:
+                operands = pop_operands(b)
+                uses = is_pure(names[a])
+            else:
+                operands = pop_operands(2 if op in BINARY else 1)
+            if uses is not None and is_known(uses) and \
+                    all(operand.known for operand in operands):
+                value = combine(operands, position + 1, 1, uses)
+                if value is not None and op == Op.CALL:
+                    # worth storing even with constant arguments
+                    value.constant = False
+            if value is None:
+                value = Value(position, position + 1, False)
+        else:
+            # labels, jumps and returns
+            del stack[:]
+            temps.clear()
+
+        if value is not None:
+            stack.append(value)
+            if value.known:
+                values.append(value)
+        position += 1
+    return values
+
+
+def temps_unused(instructions, value, end):
+    """
+    :param instructions: list of (op, a, b)
+    :param value: Value
+    :param end: position the code value is part of ends at
+    :return: True if no code after value reads the temps (and pointer 1)
+    it sets before they are set again
+    """
+    for temp in value.sets:
+        for op, a, b in instructions[value.end:end]:
+            if temp == POINTER_THAT:
+                read = a == Segment.THAT and (op == Op.PUSH or op == Op.POP)
+                overwritten = op == Op.POP and a == Segment.POINTER and b == 1
+            else:
+                read = op == Op.PUSH and a == Segment.TEMP and b == temp
+                overwritten = op == Op.POP and a == Segment.TEMP and b == temp
+            if read:
+                return False
+            if overwritten or op == Op.LABEL or op == Op.GOTO or \
+                    op == Op.IF_GOTO or op == Op.RETURN:
+                break
+    return True
@@ -0,0 +1,100 @@
+import os, glob, shutil, tempfile, unittest
+import Compiler.JackCompiler as jackcompiler
+import Compiler.CompilationEngine as engine
+
+# The sample programs of the tests: every directory under programs/ holds
+# the .jack files of one program and output.txt, what it prints compiled
+# without optimizations.
+
+PROGRAMS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "programs")
+OUTPUT_FILE_NAME = "output.txt"
+
+# programs that change a string constant, which only prints the same while
+# its uses aren't shared, see engine.OPT_IN
+CHANGE_STRINGS = frozenset(["StringGetter"])
+
+# what -O applies
+DEFAULT_OPTIMIZATIONS = [name for name in engine.OPTIMIZATIONS
+                         if name not in engine.OPT_IN]
+
+
+def names(optimizations=()):
+    """
+    :param optimizations: names of the optimizations the programs are
+    compiled with
+    :return: names of the sample programs that print their expected output
+    compiled with them
+    """
+    shared_strings = any(name in engine.OPT_IN for name in optimizations)
+    return sorted(name for name in os.listdir(PROGRAMS_DIR)
+                  if os.path.isdir(os.path.join(PROGRAMS_DIR, name)) and
+                  not (shared_strings and name in CHANGE_STRINGS))
+
+
+def expected_output(name):
+    """
+    :param name: sample program
+    :return: what it prints
+    """
+    with open(os.path.join(PROGRAMS_DIR, name, OUTPUT_FILE_NAME), 'r') as \
+            output_file:
+        return output_file.read()
+
+
+def read_outputs(directory):
+    """
+    :param directory: of a compiled program
+    :return: dict Xxx.vm -> its text
+    """
+    outputs = {}
+    for file_name in glob.glob(os.path.join(directory, "*.vm")):
+        with open(file_name, 'r') as vm_file:
+            outputs[os.path.basename(file_name)] = vm_file.read()
+    return outputs
+
+
+class ProgramTestCase(unittest.TestCase):
+    """
+    Compiles programs in a temporary directory, removed after every test
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.builds = 0
+
+    def copy(self, name):
+        """
+        :param name: sample program
+        :return: a new directory holding its sources
+        """
+        self.builds += 1
+        directory = os.path.join(self.directory, name + str(self.builds))
+        shutil.copytree(os.path.join(PROGRAMS_DIR, name), directory)
+        return directory
+
+    def write(self, directory, sources):
+        """
+        :param directory: created if it doesn't exist
+        :param sources: dict class name -> source of the class
+        :return:
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for class_name, source in sources.items():
+            with open(os.path.join(directory, class_name + ".jack"),
+                      'w') as source_file:
+                source_file.write(source)
+
+    def build(self, directory, optimizations=(), jobs=1, use_cache=False):
+        """
+        compiles all the files of directory, failing the test on errors
+        :param directory:
+        :param optimizations: names of the optimizations to apply
+        :param jobs: number of processes compiling in parallel
+        :param use_cache: keep and reuse outputs in the build cache
+        :return:
+        """
+        errors = jackcompiler.main(directory, jobs, use_cache,
+                                   list(optimizations))
+        self.assertEqual(errors, [])
@@ -0,0 +1,272 @@
+import os, glob
+
+# Runs the .vm files of a program, for the tests to compare what programs
+# compiled with different options print. The subroutines of the OS the
+# test programs call (Math, Memory, Array, String, Output, Sys) are
+# emulated in python, their output is collected as text.
+
+RAM_SIZE = 32768
+STACK_BASE = 256
+HEAP_BASE = 2048
+MAX_STEPS = 10000000
+
+SP = 0
+LCL = 1
+ARG = 2
+THIS = 3
+THAT = 4
+TEMP = 5
+
+BINARY = {
+    "add": lambda a, b: a + b,
+    "sub": lambda a, b: a - b,
+    "and": lambda a, b: a & b,
+    "or": lambda a, b: a | b,
+    "eq": lambda a, b: -1 if signed(a) == signed(b) else 0,
+    "gt": lambda a, b: -1 if signed(a) > signed(b) else 0,
+    "lt": lambda a, b: -1 if signed(a) < signed(b) else 0}
+UNARY = {
+    "neg": lambda a: -a,
+    "not": lambda a: ~a}
+POINTERS = {"local": LCL, "argument": ARG, "this": THIS, "that": THAT}
+
+
+class Halt(Exception):
+    """
+    Sys.halt or Sys.error was called
+    """
+
+
+def signed(value):
+    """
+    :param value: 16 bit word
+    :return: the word as a two's complement number
+    """
+    value &= 0xFFFF
+    return value - 0x10000 if value & 0x8000 else value
+
+
+def load(directory):
+    """
+    reads the functions of every .vm file in directory
+    :param directory:
+    :return: dict function name -> (number of locals, list of commands,
+    dict label -> index of the command after it), every command is a list
+    of its words
+    """
+    functions = {}
+    for file_name in sorted(glob.glob(os.path.join(directory, "*.vm"))):
+        with open(file_name, 'r') as vm_file:
+            for line in vm_file:
+                words = line.split("//")[0].split()
+                if not words:
+                    continue
+                if words[0] == "function":
+                    commands, labels = [], {}
+                    functions[words[1]] = (int(words[2]), commands, labels)
+                    continue
+                if words[0] == "label":
+                    labels[words[1]] = len(commands)
+                commands.append(words)
+    return functions
+
+
+class VMEmulator(object):
+    """
+    Executes VM code command by command
+    """
+    def __init__(self, functions):
+        """
+        :param functions: see load
+        """
+        self.functions = functions
+        self.ram = [0] * RAM_SIZE
+        self.statics = {}  # (class name, index) -> value
+        self.heap = HEAP_BASE
+        self.output = []
+
+    def alloc(self, size):
+        """
+        :param size: number of words
+        :return: address of a new block, blocks are never freed
+        """
+        address = self.heap
+        self.heap += max(size, 1)
+        return address
+
+    def call_os(self, name, arguments):
+        """
+        runs an OS subroutine
+        :param name: Class.subroutine
+        :param arguments: list of words
+        :return: the value it returns
+        """
+        ram = self.ram
+        values = [signed(argument) for argument in arguments]
+        if name == "Math.multiply":
+            return values[0] * values[1]
+        if name == "Math.divide":
+            if values[1] == 0:
+                raise ZeroDivisionError(name)
+            quotient = abs(values[0]) // abs(values[1])
+            return quotient if (values[0] < 0) == (values[1] < 0) \
+                else -quotient
+        if name == "Math.abs":
+            return abs(values[0])
+        if name == "Math.min":
+            return min(values)
+        if name == "Math.max":
+            return max(values)
+        if name in ("Memory.alloc", "Array.new"):
+            return self.alloc(values[0])
+        if name in ("Memory.deAlloc", "Array.dispose", "String.dispose"):
+            return 0
+        if name == "String.new":
+            # [max length, length, characters...]
+            string = self.alloc(values[0] + 2)
+            ram[string], ram[string + 1] = values[0], 0
+            return string
+        if name == "String.appendChar":
+            string = arguments[0]
+            ram[string + 2 + ram[string + 1]] = arguments[1]
+            ram[string + 1] += 1
+            return string
+        if name == "String.length":
+            return ram[arguments[0] + 1]
+        if name == "String.charAt":
+            return ram[arguments[0] + 2 + arguments[1]]
+        if name == "String.setCharAt":
+            ram[arguments[0] + 2 + arguments[1]] = arguments[2]
+            return 0
+        if name == "Output.printInt":
+            self.output.append(str(values[0]))
+            return 0
+        if name == "Output.printChar":
+            self.output.append(chr(arguments[0]))
+            return 0
+        if name == "Output.printString":
+            string = arguments[0]
+            self.output.append("".join(
+                chr(ram[string + 2 + i]) for i in range(ram[string + 1])))
+            return 0
+        if name == "Output.println":
+            self.output.append("\n")
+            return 0
+        if name == "Sys.halt":
+            raise Halt()
+        if name == "Sys.error":
+            self.output.append("ERR" + str(values[0]))
+            raise Halt()
+        raise ValueError("Unknown function " + name)
+
+    def address(self, segment, index):
+        """
+        :param segment: name of a segment other than constant and static
+        :param index:
+        :return: RAM address of the entry
+        """
+        if segment in POINTERS:
+            return self.ram[POINTERS[segment]] + index
+        if segment == "pointer":
+            return THIS + index
+        if segment == "temp":
+            return TEMP + index
+        raise ValueError("Unknown segment " + segment)
+
+    def run(self, entry="Main.main", max_steps=MAX_STEPS):
+        """
+        calls entry and runs until it returns or the program halts
+        :param entry: function to start with
+        :param max_steps: number of commands after which the program is
+        taken to loop forever
+        :return: what the program printed
+        """
+        ram = self.ram
+        ram[SP] = STACK_BASE
+        frames = []  # (function, position, LCL, ARG, THIS, THAT) to return to
+        name, position = entry, 0
+        n_locals, commands, labels = self.functions[name]
+        ram[LCL] = ram[ARG] = STACK_BASE
+        ram[SP] += n_locals
+        steps = 0
+        try:
+            while True:
+                steps += 1
+                if steps > max_steps:
+                    raise RuntimeError("No end after " + str(max_steps) +
+                                       " commands")
+                words = commands[position]
+                position += 1
+                op = words[0]
+                sp = ram[SP]
+                if op == "push":
+                    segment, index = words[1], int(words[2])
+                    if segment == "constant":
+                        value = index
+                    elif segment == "static":
+                        value = self.statics.get(
+                            (name.split(".")[0], index), 0)
+                    else:
+                        value = ram[self.address(segment, index)]
+                    ram[sp] = value & 0xFFFF
+                    ram[SP] = sp + 1
+                elif op == "pop":
+                    segment, index = words[1], int(words[2])
+                    value = ram[sp - 1]
+                    ram[SP] = sp - 1
+                    if segment == "static":
+                        self.statics[(name.split(".")[0], index)] = value
+                    else:
+                        ram[self.address(segment, index)] = value
+                elif op in BINARY:
+                    ram[sp - 2] = BINARY[op](ram[sp - 2], ram[sp - 1]) & 0xFFFF
+                    ram[SP] = sp - 1
+                elif op in UNARY:
+                    ram[sp - 1] = UNARY[op](ram[sp - 1]) & 0xFFFF
+                elif op == "label":
+                    pass
+                elif op == "goto":
+                    position = labels[words[1]]
+                elif op == "if-goto":
+                    ram[SP] = sp - 1
+                    if ram[sp - 1]:
+                        position = labels[words[1]]
+                elif op == "call":
+                    callee, n_arguments = words[1], int(words[2])
+                    if callee not in self.functions:
+                        value = self.call_os(callee,
+                                             ram[sp - n_arguments:sp])
+                        ram[sp - n_arguments] = value & 0xFFFF
+                        ram[SP] = sp - n_arguments + 1
+                        continue
+                    frames.append((name, position, ram[LCL], ram[ARG],
+                                   ram[THIS], ram[THAT]))
+                    name, position = callee, 0
+                    n_locals, commands, labels = self.functions[name]
+                    ram[ARG] = sp - n_arguments
+                    ram[LCL] = sp
+                    for local in range(n_locals):
+                        ram[sp + local] = 0
+                    ram[SP] = sp + n_locals
+                elif op == "return":
+                    value = ram[sp - 1]
+                    ram[ram[ARG]] = value
+                    ram[SP] = ram[ARG] + 1
+                    if not frames:
+                        break
+                    name, position, ram[LCL], ram[ARG], ram[THIS], \
+                        ram[THAT] = frames.pop()
+                    n_locals, commands, labels = self.functions[name]
+                else:
+                    raise ValueError("Unknown command " + " ".join(words))
+        except Halt:
+            pass
+        return "".join(self.output)
+
+
+def run(directory):
+    """
+    :param directory: holding the .vm files of a program
+    :return: what the program printed
+    """
+    return VMEmulator(load(directory)).run()
@@ -0,0 +1,112 @@
+import os, unittest
+import Compiler.JackCompiler as jackcompiler
+import Compiler.BuildCache as buildcache
+import tests.Programs as programs
+import tests.VMEmulator as vmemulator
+
+MAIN = """
+class Main {
+    function void main() {
+        do Output.printInt(Helper.twice(21));
+        return;
+    }
+}
+"""
+MAIN_TWO_ARGUMENTS = MAIN.replace("Helper.twice(21)", "Helper.twice(21, 1)")
+HELPER = """
+class Helper {
+    function int twice(int x) {
+        return x + x;
+    }
+}
+"""
+# same interface, other body
+HELPER_MULTIPLY = HELPER.replace("x + x", "x * 2")
+# twice takes another argument
+HELPER_TWO_ARGUMENTS = HELPER.replace("int x)", "int x, int y)").replace(
+    "x + x", "x + y")
+
+
+class CacheTest(programs.ProgramTestCase):
+
+    def setUp(self):
+        programs.ProgramTestCase.setUp(self)
+        self.program = os.path.join(self.directory, "Program")
+        self.write(self.program, {"Main": MAIN, "Helper": HELPER})
+        self.build(self.program, use_cache=True)
+
+    def read_main(self):
+        """
+        :return: text of Main.vm
+        """
+        return programs.read_outputs(self.program)["Main.vm"]
+
+    def test_restore(self):
+        main = self.read_main()
+        os.remove(os.path.join(self.program, "Main.vm"))
+        self.build(self.program, use_cache=True)
+        self.assertEqual(self.read_main(), main)
+        self.assertEqual(vmemulator.run(self.program), "42")
+
+    def test_body_change(self):
+        main = self.read_main()
+        self.write(self.program, {"Helper": HELPER_MULTIPLY})
+        self.build(self.program, use_cache=True)
+        self.assertEqual(self.read_main(), main)
+        self.assertEqual(vmemulator.run(self.program), "42")
+
+    def test_interface_change(self):
+        # Main.jack didn't change, but its cached output was compiled
+        # against the old Helper.twice and must not be reused
+        self.write(self.program, {"Helper": HELPER_TWO_ARGUMENTS})
+        errors = jackcompiler.main(self.program, 1, True)
+        self.assertEqual(len(errors), 1)
+        self.assertIn("Main.jack", errors[0])
+        self.assertIn("Helper.twice expects 2 arguments", errors[0])
+
+        self.write(self.program, {"Main": MAIN_TWO_ARGUMENTS})
+        self.build(self.program, use_cache=True)
+        self.assertEqual(vmemulator.run(self.program), "22")
+
+    def test_prune(self):
+        cache_dir = os.path.join(self.program, buildcache.CACHE_DIR_NAME)
+        entries = sorted(os.listdir(cache_dir))
+        self.write(self.program, {"Helper": HELPER_MULTIPLY})
+        self.build(self.program, use_cache=True)
+        self.write(self.program, {"Helper": HELPER})
+        self.build(self.program, use_cache=True)
+        self.assertEqual(sorted(os.listdir(cache_dir)), entries)
+
+    def test_single_file(self):
+        cache_dir = os.path.join(self.program, buildcache.CACHE_DIR_NAME)
+        entries = sorted(os.listdir(cache_dir))
+        index = buildcache.BuildCache(cache_dir).load_index().classes
+        self.build(os.path.join(self.program, "Main.jack"), use_cache=True)
+        self.assertEqual(sorted(os.listdir(cache_dir)), entries)
+        self.assertEqual(buildcache.BuildCache(cache_dir).load_index().classes,
+                         index)
+
+
+class JobsTest(programs.ProgramTestCase):
+
+    def test_same_output(self):
+        for optimizations in ((), programs.DEFAULT_OPTIMIZATIONS):
+            for name in programs.names():
+                with self.subTest(optimizations=optimizations, program=name):
+                    sequential = self.copy(name)
+                    self.build(sequential, optimizations, jobs=1)
+                    parallel = self.copy(name)
+                    self.build(parallel, optimizations, jobs=4)
+                    self.assertEqual(programs.read_outputs(parallel),
+                                     programs.read_outputs(sequential))
+
+    def test_same_errors(self):
+        directory = os.path.join(self.directory, "Errors")
+        self.write(directory, {"Main": MAIN, "Helper": HELPER_TWO_ARGUMENTS,
+                               "Broken": "class Broken { /* never closed"})
+        self.assertEqual(jackcompiler.main(directory, 4, False),
+                         jackcompiler.main(directory, 1, False))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import Compiler.CompilationEngine as engine
+import tests.Programs as programs
+import tests.VMEmulator as vmemulator
+
+# Differential tests: every sample program has to print the same with each
+# optimization on its own and with all of them as without any.
+
+
+class OptimizationsTest(programs.ProgramTestCase):
+
+    def run_program(self, name, optimizations):
+        """
+        :param name: sample program
+        :param optimizations: names of the optimizations to apply
+        :return: what the program prints compiled with them
+        """
+        directory = self.copy(name)
+        self.build(directory, optimizations)
+        return vmemulator.run(directory)
+
+    def test_unoptimized(self):
+        for name in programs.names():
+            with self.subTest(program=name):
+                self.assertEqual(self.run_program(name, ()),
+                                 programs.expected_output(name))
+
+    def test_each_optimization(self):
+        for optimization in engine.OPTIMIZATIONS:
+            for name in programs.names([optimization]):
+                with self.subTest(optimization=optimization, program=name):
+                    self.assertEqual(self.run_program(name, [optimization]),
+                                     programs.expected_output(name))
+
+    def test_all_optimizations(self):
+        for name in programs.names():
+            with self.subTest(program=name):
+                self.assertEqual(
+                    self.run_program(name, programs.DEFAULT_OPTIMIZATIONS),
+                    programs.expected_output(name))
+
+    def test_all_optimizations_and_string_pool(self):
+        for name in programs.names(engine.OPTIMIZATIONS):
+            with self.subTest(program=name):
+                self.assertEqual(
+                    self.run_program(name, engine.OPTIMIZATIONS),
+                    programs.expected_output(name))
+
+    def test_non_boolean_conditions(self):
+        # any value but 0 is true, not only -1: 5 & 1 is 1, ~4 is -5
+        for optimizations in ([engine.O_BRANCHES], [engine.O_PEEPHOLE],
+                              [engine.O_PROPAGATION],
+                              programs.DEFAULT_OPTIMIZATIONS):
+            with self.subTest(optimizations=optimizations):
+                self.assertEqual(
+                    self.run_program("NonBoolean", optimizations),
+                    "20 72 73 73 0 2 4 6\n")
+
+    def test_own_os_classes(self):
+        # only the OS calls Math.init and Math.divide
+        directory = self.copy("OwnMath")
+        self.build(directory, programs.DEFAULT_OPTIMIZATIONS)
+        math = programs.read_outputs(directory)["Math.vm"]
+        self.assertIn("function Math.init ", math)
+        self.assertIn("function Math.divide ", math)
+
+
+if __name__ == "__main__":
+    unittest.main()
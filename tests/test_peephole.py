@@ -0,0 +1,155 @@
+import unittest
+import Compiler.VMCode as vmcode
+import Compiler.Peephole as peephole
+
+
+def optimize(body, rules=None):
+    """
+    :param body: VM commands of a function, one per line
+    :param rules: rules of the Peephole, all of them if None
+    :return: the commands after the peephole pass
+    """
+    code = vmcode.parse("function Main.f 0\n" + body)
+    optimizer = peephole.Peephole(rules)
+    for function in code.functions:
+        optimizer(function, code)
+    return vmcode.serialize(code).split("\n", 1)[1]
+
+
+def rule(name):
+    """
+    :param name: name of rules in RULES
+    :return: list of the rules of that name
+    """
+    return [entry for entry in peephole.RULES if entry[0] == name]
+
+
+class PeepholeTest(unittest.TestCase):
+
+    def assertRewrite(self, name, before, after):
+        """
+        checks what the rules of one name alone make of before
+        :param name: rule name
+        :param before: VM commands
+        :param after: VM commands expected
+        """
+        self.assertEqual(optimize(before, rule(name)), after)
+
+    def assertUnchanged(self, name, before):
+        """
+        checks that the rules of one name leave before as it is
+        :param name: rule name
+        :param before: VM commands
+        """
+        self.assertRewrite(name, before, before)
+
+    def test_rules_covered(self):
+        tested = set(name[len("test_"):].replace("_", "-")
+                     for name in dir(self) if name.startswith("test_"))
+        self.assertEqual(set(entry[0] for entry in peephole.RULES) - tested,
+                         set())
+
+    def test_push_pop(self):
+        self.assertRewrite("push-pop",
+                           "push local 1\npop local 1\nreturn\n",
+                           "return\n")
+        self.assertUnchanged("push-pop",
+                             "push local 1\npop local 2\nreturn\n")
+        self.assertUnchanged("push-pop",
+                             "push local 1\npop argument 1\nreturn\n")
+
+    def test_not_not(self):
+        self.assertRewrite("not-not",
+                           "push local 0\nnot\nnot\nreturn\n",
+                           "push local 0\nreturn\n")
+
+    def test_neg_neg(self):
+        self.assertRewrite("neg-neg",
+                           "push local 0\nneg\nneg\nreturn\n",
+                           "push local 0\nreturn\n")
+
+    def test_add_zero(self):
+        self.assertRewrite("add-zero",
+                           "push local 0\npush constant 0\nadd\nreturn\n",
+                           "push local 0\nreturn\n")
+        self.assertUnchanged("add-zero",
+                             "push local 0\npush constant 1\nadd\nreturn\n")
+        self.assertUnchanged("add-zero",
+                             "push local 0\npush local 1\nadd\nreturn\n")
+
+    def test_sub_zero(self):
+        self.assertRewrite("sub-zero",
+                           "push local 0\npush constant 0\nsub\nreturn\n",
+                           "push local 0\nreturn\n")
+        self.assertUnchanged("sub-zero",
+                             "push constant 0\npush local 0\nsub\nreturn\n")
+
+    def test_or_zero(self):
+        self.assertRewrite("or-zero",
+                           "push local 0\npush constant 0\nor\nreturn\n",
+                           "push local 0\nreturn\n")
+
+    def test_and_true(self):
+        self.assertRewrite("and-true",
+                           "push local 0\npush constant 0\nnot\nand\n"
+                           "return\n",
+                           "push local 0\nreturn\n")
+        self.assertUnchanged("and-true",
+                             "push local 0\npush constant 1\nnot\nand\n"
+                             "return\n")
+
+    def test_constant_branch(self):
+        self.assertRewrite("constant-branch",
+                           "push constant 0\nif-goto L\nlabel L\nreturn\n",
+                           "label L\nreturn\n")
+        # any nonzero value jumps, not only true
+        self.assertRewrite("constant-branch",
+                           "push constant 5\nif-goto L\nlabel L\nreturn\n",
+                           "goto L\nlabel L\nreturn\n")
+        self.assertUnchanged("constant-branch",
+                             "push local 0\nif-goto L\nlabel L\nreturn\n")
+
+    def test_true_branch(self):
+        self.assertRewrite("true-branch",
+                           "push constant 0\nnot\nif-goto L\nlabel L\n"
+                           "return\n",
+                           "goto L\nlabel L\nreturn\n")
+        self.assertUnchanged("true-branch",
+                             "push constant 1\nnot\nif-goto L\nlabel L\n"
+                             "return\n")
+
+    def test_inverted_branch(self):
+        for comparison in ("eq", "gt", "lt"):
+            self.assertRewrite(
+                "inverted-branch",
+                "push local 0\npush local 1\n" + comparison + "\nnot\n"
+                "if-goto A\ngoto B\nlabel A\nreturn\nlabel B\nreturn\n",
+                "push local 0\npush local 1\n" + comparison + "\n"
+                "if-goto B\nlabel A\nreturn\nlabel B\nreturn\n")
+        # 1 & 1 is 1, ~1 is -2: both are true, the branch can't be inverted
+        self.assertUnchanged(
+            "inverted-branch",
+            "push local 0\npush constant 1\nand\nnot\n"
+            "if-goto A\ngoto B\nlabel A\nreturn\nlabel B\nreturn\n")
+        # the goto doesn't jump over the label
+        self.assertUnchanged(
+            "inverted-branch",
+            "push local 0\npush local 1\nlt\nnot\n"
+            "if-goto A\ngoto B\nlabel C\nreturn\nlabel A\nlabel B\nreturn\n")
+
+    def test_goto_next(self):
+        self.assertRewrite("goto-next",
+                           "goto L\nlabel L\nreturn\n",
+                           "label L\nreturn\n")
+        self.assertUnchanged("goto-next",
+                             "goto L\nlabel M\nlabel L\nreturn\n")
+
+    def test_cascade(self):
+        # the replacement goes through the rules again
+        self.assertEqual(optimize("push constant 0\nnot\nnot\nif-goto L\n"
+                                  "push local 0\nlabel L\nreturn\n"),
+                         "push local 0\nlabel L\nreturn\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+import unittest
+import Compiler.JackTokenizer as tokenizer
+import Compiler.ClassIndex as classindex
+from Compiler.JackGrammar import *
+
+SOURCE = b"""class Main {
+    // comment
+    /* comment
+       on lines */
+    function void main() {
+        do Output.printString("a // b");
+        return;
+    }
+}
+"""
+
+
+def tokens(source):
+    """
+    :param source: bytes
+    :return: list of (value, type) of its tokens
+    """
+    buffer = tokenizer.JackTokenizer(source, None).tokens
+    return [buffer[index] for index in range(len(buffer))]
+
+
+class LexerTest(unittest.TestCase):
+
+    def assertError(self, source, message):
+        """
+        checks that tokenizing source fails
+        :param source: bytes
+        :param message: the error
+        """
+        with self.assertRaises(ValueError) as raised:
+            tokenizer.JackTokenizer(source, None)
+        self.assertEqual(str(raised.exception), message)
+
+    def test_tokens(self):
+        self.assertEqual(tokens(SOURCE)[:8],
+                         [("class", KEYWORD), ("Main", IDENTIFIER),
+                          ("{", SYMBOL), ("function", KEYWORD),
+                          ("void", KEYWORD), ("main", IDENTIFIER),
+                          ("(", SYMBOL), (")", SYMBOL)])
+        self.assertIn(("a // b", STRING_CONS), tokens(SOURCE))
+        self.assertEqual(tokens(b"x<=12"),
+                         [("x", IDENTIFIER), ("<", SYMBOL), ("=", SYMBOL),
+                          ("12", INT_CONST)])
+
+    def test_unterminated_comment(self):
+        self.assertError(SOURCE.replace(b"*/", b""),
+                         "Unterminated comment in line 3")
+        self.assertError(b"class Main {\n}\n/* x",
+                         "Unterminated comment in line 3")
+
+    def test_unterminated_string(self):
+        self.assertError(SOURCE.replace(b'b")', b'b)'),
+                         "Unterminated string in line 6")
+
+    def test_illegal_character(self):
+        self.assertError(b"class Main {\n\n  let x = #;",
+                         "Illegal character b'#' in line 3")
+
+    def test_skim_errors(self):
+        # bodies are skipped over when skimming, not tokenized
+        for source, message in (
+                (SOURCE.replace(b"return;", b"return; /*"),
+                 "Unterminated comment in line 7"),
+                (SOURCE.replace(b'b")', b'b)'),
+                 "Unterminated string in line 6")):
+            with self.assertRaises(ValueError) as raised:
+                classindex.skim(source)
+            self.assertEqual(str(raised.exception), message)
+
+
+class TokenBufferTest(unittest.TestCase):
+
+    def test_interned_names(self):
+        buffer = tokenizer.JackTokenizer(b"let x = x + y; let y = x;",
+                                         None).tokens
+        self.assertEqual(len(buffer), 12)
+        # let x = + y ;
+        self.assertEqual(len(buffer.names), 6)
+        self.assertEqual(buffer.ids[1], buffer.ids[3])
+        self.assertEqual(buffer.ids[0], buffer.ids[7])
+        self.assertNotEqual(buffer.ids[1], buffer.ids[5])
+
+    def test_constants(self):
+        buffer = tokenizer.JackTokenizer(b'let s = "x"; let n = 120;',
+                                         None).tokens
+        # constants are sliced out of the code, not interned
+        self.assertEqual(buffer.ids[3], tokenizer.NO_ID)
+        self.assertEqual(buffer[3], ("x", STRING_CONS))
+        self.assertEqual(buffer.ids[8], tokenizer.NO_ID)
+        self.assertEqual(buffer[8], ("120", INT_CONST))
+        self.assertNotIn("x", buffer.names)
+        self.assertEqual((buffer.starts[3], buffer.ends[3]), (9, 10))
+
+
+class PeekTest(unittest.TestCase):
+
+    def test_peek(self):
+        stream = tokenizer.JackTokenizer(b"do f(1);", None)
+        self.assertEqual(stream.peek(), ("do", KEYWORD))
+        self.assertEqual(stream.peek(3), ("(", SYMBOL))
+        self.assertEqual(stream.peek_value(4), "1")
+        stream.advance()
+        stream.advance()
+        self.assertEqual(stream.phrase_value(), "f")
+        self.assertEqual(stream.peek(4), (";", SYMBOL))
+
+    def test_end_of_input(self):
+        stream = tokenizer.JackTokenizer(b"return x;", None)
+        self.assertEqual(stream.peek(4), (NO_PHRASE, NO_TOKEN))
+        self.assertEqual(stream.peek_value(10), NO_PHRASE)
+        for token in range(3):
+            self.assertTrue(stream.has_more_tokens())
+            stream.advance()
+        self.assertEqual(stream.phrase_value(), ";")
+        self.assertFalse(stream.has_more_tokens())
+        self.assertEqual(stream.peek(), (NO_PHRASE, NO_TOKEN))
+        stream.advance()
+        self.assertEqual((stream.phrase_value(), stream.token_type()),
+                         (NO_PHRASE, NO_TOKEN))
+
+    def test_empty_input(self):
+        stream = tokenizer.JackTokenizer(b"  // nothing", None)
+        self.assertFalse(stream.has_more_tokens())
+        self.assertEqual(stream.peek(), (NO_PHRASE, NO_TOKEN))
+
+
+if __name__ == "__main__":
+    unittest.main()